@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from output_file import write_if_changed
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tree(src_dir):
+    '''
+    the files of src_dir, symlinks followed, for ArtifactCache.store
+    returns {path relative to src_dir: path}
+    '''
+    files = {}
+    for root, dirs, names in os.walk(src_dir, followlinks=True):
+        dirs[:] = [d for d in dirs if d != '.git']
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                files[os.path.relpath(path, src_dir)] = path
+    return files
+
+
+def subtree(files, prefix):
+    '''
+    the files of an entry under the directory prefix, relative to it
+    files --> {relative path: sha1}
+    '''
+    prefix = prefix.rstrip('/') + '/'
+    return dict((rel[len(prefix):], sha1) for rel, sha1 in files.iteritems()
+                if rel.startswith(prefix))
+
+
+class ArtifactCache(object):
+    '''
+    Local store of the plugin trees and bower artifacts of an install, so
+    they are fetched once for every (name, version) and reinstalls and other
+    targets reuse them without the network. The version must be resolved, a
+    tag or commit, not a range or branch that can point to other files later.
+    The files are stored once by the sha1 of their content under objects, an
+    entry of a (name, version) lists the sha1 of each of its files, and
+    installing an entry copies the objects into place, so editing or
+    building the installed files doesn't change the cache.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.objects = os.path.join(path, 'objects')
+        self.entries = os.path.join(path, 'entries')
+
+    def _entry(self, name, version):
+        return os.path.join(self.entries, name,
+                            '{0}.json'.format(hashlib.sha1(version).hexdigest()))
+
+    def _object(self, sha1):
+        return os.path.join(self.objects, sha1[:2], sha1[2:])
+
+    def get(self, name, version):
+        '''
+        the files of the entry of name and version, None if it isn't cached
+        returns {relative path: sha1}
+        '''
+        path = self._entry(name, version)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            files = json.load(f)['files']
+        if not all(os.path.exists(self._object(sha1)) for sha1 in files.itervalues()):
+            # objects removed by hand, fetch again
+            return None
+        return files
+
+    def store(self, name, version, files):
+        '''
+        add the entry of name and version
+        files --> {relative path: path of the file to store}
+        returns {relative path: sha1}
+        '''
+        stored = {}
+        for rel, src in files.iteritems():
+            sha1 = file_sha1(src)
+            obj = self._object(sha1)
+            if not os.path.exists(obj):
+                d = os.path.dirname(obj)
+                if not os.path.exists(d):
+                    try:
+                        os.makedirs(d)
+                    except OSError:
+                        # created by another install at the same time
+                        if not os.path.isdir(d):
+                            raise
+                fd, tmp = tempfile.mkstemp(dir=d, suffix='.tmp')
+                os.close(fd)
+                shutil.copyfile(src, tmp)
+                os.chmod(tmp, 0644)
+                os.rename(tmp, obj)
+            stored[rel.replace(os.sep, '/')] = sha1
+
+        path = self._entry(name, version)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        write_if_changed(path, json.dumps({
+            "name": name,
+            "version": version,
+            "files": stored
+        }, indent=2, sort_keys=True))
+        return stored
+
+    def install(self, files, dest):
+        '''
+        copy the files of an entry into dest, existing files are replaced
+        files --> {relative path: sha1}
+        '''
+        for rel, sha1 in files.iteritems():
+            target = os.path.join(dest, *rel.split('/'))
+            d = os.path.dirname(target)
+            if not os.path.exists(d):
+                os.makedirs(d)
+            if os.path.lexists(target):
+                os.remove(target)
+            shutil.copyfile(self._object(sha1), target)
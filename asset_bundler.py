@@ -0,0 +1,520 @@
+import collections
+import json
+import os
+import posixpath
+import re
+import subprocess
+
+from output_file import write_if_changed
+
+# tags of the generated pages, comments are matched so the tags inside them
+# are left alone
+TAG = re.compile(r'<!--.*?-->|<script\b([^>]*)>(.*?)</script\s*>|<link\b([^>]*?)/?>|<style\b',
+                 re.I | re.S)
+ATTRIBUTE = re.compile(r'''([\w:.-]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?''')
+
+# the regular expressions requirejs uses to find the dependencies of a
+# define(function(require){...}) module
+COMMENT = re.compile(r'(/\*([\s\S]*?)\*/|([^:]|^)//(.*)$)', re.M)
+CJS_REQUIRE = re.compile(r'''[^.]\s*require\s*\(\s*["']([^'"\s]+)["']\s*\)''')
+DEFINE = re.compile(r'(?:^|[^.\w$])define\s*\(')
+REQUIRE_ARRAY = re.compile(r'''(?:^|[^.\w$])require(?:js)?\s*\(\s*\[([^\]]*)\]''')
+STRING = re.compile(r'''^\s*["']([^"']+)["']\s*$''')
+PATHS = re.compile(r'paths\s*:\s*\{([^}]*)\}')
+PATH = re.compile(r'''["']?([\w/.-]+)["']?\s*:\s*["']([^"']+)["']''')
+
+SOURCE_MAP_URL = re.compile(r'^\s*(//[#@]\s*sourceMappingURL=.*|/\*[#@]\s*sourceMappingURL=.*\*/)\s*$')
+CSS_URL = re.compile(r'''url\(\s*(["']?)([^"')]+)\1\s*\)''')
+CSS_IMPORT = re.compile(r'''@import\s+(?:url\(\s*)?["']?([^"')\s;]+)["']?\s*\)?\s*;''')
+CSS_CHARSET = re.compile(r'''@charset\s+["'][^"']*["']\s*;''')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s*([{};,])\s*')
+
+BASE64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+
+def _attributes(text):
+    attributes = {}
+    for name, value in ATTRIBUTE.findall(text or ''):
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        attributes[name.lower()] = value
+    return attributes
+
+
+def _is_local(url, www_dir):
+    if not url or ':' in url or url.startswith('/') or '?' in url or '#' in url:
+        return False
+    return os.path.isfile(os.path.join(www_dir, *url.split('/')))
+
+
+def rewrite(html, page, www_dir):
+    '''
+    replace the runs of local scripts and stylesheets of a generated page
+    with a bundle each. A run of scripts is ended by a script that can't be
+    bundled, e.g. cordova.js or an inline script, and a run of stylesheets
+    by one that can't be bundled, a style element or a different media, so
+    the order the browser runs and applies them in is kept. The page of a
+    script with data-main, requirejs, also gets the modules of the main
+    module bundled.
+    page --> the path of the page relative to www_dir
+    returns (html, bundles), bundles is the plan of AssetBundler.build
+    '''
+    name = os.path.splitext(page)[0].replace('/', '-').replace(os.sep, '-')
+    runs = []
+    current = {"js": None, "css": None}
+
+    def end(kind):
+        if current[kind] is not None:
+            runs.append(current[kind])
+            current[kind] = None
+
+    for match in TAG.finditer(html):
+        text = match.group(0)
+        if text.startswith('<!--'):
+            continue
+        if match.group(1) is not None or text.lower().startswith('<script'):
+            attrs = _attributes(match.group(1))
+            src = attrs.get('src')
+            if (match.group(2).strip() or 'async' in attrs or 'defer' in attrs or
+                    attrs.get('type', 'text/javascript') != 'text/javascript' or
+                    not _is_local(src, www_dir)):
+                end("js")
+                continue
+            if current["js"] is None:
+                current["js"] = {"kind": "js", "files": [], "tags": [], "main": None}
+            current["js"]["files"].append(src)
+            current["js"]["tags"].append(match.span())
+            if 'data-main' in attrs:
+                current["js"]["main"] = attrs['data-main']
+                end("js")
+        elif text.lower().startswith('<style'):
+            end("css")
+        else:
+            attrs = _attributes(match.group(3))
+            if attrs.get('rel', '').lower() != 'stylesheet':
+                continue
+            href = attrs.get('href')
+            media = attrs.get('media', 'all')
+            if not _is_local(href, www_dir):
+                end("css")
+                continue
+            if current["css"] is not None and current["css"]["media"] != media:
+                end("css")
+            if current["css"] is None:
+                current["css"] = {"kind": "css", "files": [], "tags": [], "media": media}
+            current["css"]["files"].append(href)
+            current["css"]["tags"].append(match.span())
+    end("js")
+    end("css")
+
+    bundles = []
+    edits = []
+    count = {"js": 0, "css": 0}
+    for run in runs:
+        if len(run["files"]) < 2 and not run.get("main"):
+            # nothing to save
+            continue
+        kind = run["kind"]
+        count[kind] += 1
+        output = 'bundles/{0}{1}.{2}'.format(
+            name, '' if count[kind] == 1 else '-{0}'.format(count[kind]), kind)
+        if kind == "js":
+            tag = '<script src="{0}"></script>'.format(output)
+        elif run["media"] == 'all':
+            tag = '<link rel="stylesheet" href="{0}">'.format(output)
+        else:
+            tag = '<link rel="stylesheet" href="{0}" media="{1}">'.format(output, run["media"])
+        edits.append((run["tags"][0], tag))
+        for start, stop in run["tags"][1:]:
+            # take the indentation of the tag with it
+            while start > 0 and html[start - 1] in ' \t':
+                start -= 1
+            if start > 0 and html[start - 1] == '\n':
+                start -= 1
+            edits.append(((start, stop), ''))
+        bundle = collections.OrderedDict([
+            ("output", output), ("kind", kind), ("files", run["files"])])
+        if kind == "js":
+            bundle["main"] = run["main"]
+        else:
+            bundle["media"] = run["media"]
+        bundles.append(bundle)
+
+    for (start, stop), text in sorted(edits, reverse=True):
+        html = html[:start] + text + html[stop:]
+    return html, bundles
+
+
+class SourceMap(object):
+    '''
+    Version 3 source map of a bundle that maps every line of the bundle to
+    the line of the file it came from
+    '''
+
+    def __init__(self, file):
+        self.file = file
+        self.sources = []
+        self.lines = []
+        self._index = {}
+
+    def add(self, source, line):
+        '''
+        map the next line of the bundle to line, from 0, of source, or to
+        nothing if source is None
+        '''
+        if source is None:
+            self.lines.append(None)
+            return
+        if source not in self._index:
+            self._index[source] = len(self.sources)
+            self.sources.append(source)
+        self.lines.append((self._index[source], line))
+
+    def dumps(self):
+        mappings = []
+        previous = [0, 0]
+        for mapping in self.lines:
+            if mapping is None:
+                mappings.append('')
+                continue
+            source, line = mapping
+            mappings.append(''.join(_vlq(value) for value in [
+                0, source - previous[0], line - previous[1], 0]))
+            previous = [source, line]
+        return json.dumps(collections.OrderedDict([
+            ("version", 3),
+            ("file", self.file),
+            ("sources", self.sources),
+            ("names", []),
+            ("mappings", ';'.join(mappings))
+        ]))
+
+
+def _vlq(value):
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        encoded += BASE64[digit]
+        if not value:
+            return encoded
+
+
+class AssetBundler(object):
+    '''
+    Build the bundles planned by rewrite in www_dir/bundles, each with a
+    source map. Javascript bundles are minified by uglifyjs, when it's
+    installed, and stylesheets by removing the comments and the whitespace
+    of every line.
+    '''
+
+    def __init__(self, www_dir, build_dir, minify=False, uglifyjs=None):
+        '''
+        www_dir --> the www directory of the app
+        build_dir --> directory of the plans of the pages
+        minify --> minify the bundles
+        uglifyjs --> path of uglifyjs, the javascript is only concatenated
+                     without it
+        '''
+        self.www_dir = www_dir
+        self.build_dir = build_dir
+        self.minify = minify
+        self.uglifyjs = uglifyjs
+        self.warnings = []
+
+    def plan_path(self, page):
+        return os.path.join(self.build_dir, '{0}.json'.format(page.replace(os.sep, '/').replace('/', '-')))
+
+    def save_plan(self, page, bundles):
+        '''
+        keep the bundles of page for build, for when the page is skipped by
+        the next generation
+        '''
+        path = self.plan_path(page)
+        if not bundles:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        if not os.path.exists(self.build_dir):
+            os.makedirs(self.build_dir)
+        write_if_changed(path, json.dumps({"page": page, "bundles": bundles}, indent=2))
+
+    def build(self):
+        '''
+        build the bundles of every page still generated
+        returns [(bundle, number of files, bytes of the files, bytes of the bundle)]
+        '''
+        sizes = []
+        if not os.path.exists(self.build_dir):
+            return sizes
+        for f in sorted(os.listdir(self.build_dir)):
+            if not f.endswith('.json'):
+                continue
+            with open(os.path.join(self.build_dir, f), 'r') as fp:
+                plan = json.load(fp)
+            if not os.path.exists(os.path.join(self.www_dir, plan["page"])):
+                continue
+            for bundle in plan["bundles"]:
+                if bundle["kind"] == "js":
+                    sizes.append(self._build_js(bundle))
+                else:
+                    sizes.append(self._build_css(bundle))
+        return sizes
+
+    def _path(self, url):
+        return os.path.join(self.www_dir, *url.split('/'))
+
+    def _read(self, url):
+        with open(self._path(url), 'rb') as f:
+            return f.read()
+
+    def _source(self, bundle, url):
+        # sources are relative to the map, next to the bundle
+        return posixpath.relpath(url, posixpath.dirname(bundle["output"]))
+
+    def _write(self, bundle, lines, source_map):
+        '''
+        write the bundle and its map, lines are (source url, line, text)
+        '''
+        for url, line, text in lines:
+            source_map.add(url and self._source(bundle, url), line)
+        out = self._path(bundle["output"])
+        if not os.path.exists(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        name = posixpath.basename(bundle["output"])
+        if bundle["kind"] == "js":
+            comment = '//# sourceMappingURL={0}.map'.format(name)
+        else:
+            comment = '/*# sourceMappingURL={0}.map */'.format(name)
+        data = '\n'.join([text for url, line, text in lines] + [comment]) + '\n'
+        write_if_changed(out, data)
+        write_if_changed(out + '.map', source_map.dumps())
+        return len(data)
+
+    def _lines(self, url, text):
+        lines = []
+        for i, line in enumerate(text.splitlines()):
+            if not SOURCE_MAP_URL.match(line):
+                lines.append((url, i, line))
+        return lines
+
+    def _build_js(self, bundle):
+        lines = []
+        size = 0
+        for url in bundle["files"]:
+            text = self._read(url)
+            size += len(text)
+            lines.extend(self._lines(url, text))
+            # a file can end without a semicolon
+            lines.append((None, 0, ';'))
+
+        main = bundle.get("main")
+        if main:
+            base = posixpath.dirname(main)
+            main_url = main if main.endswith('.js') else main + '.js'
+            lines.append((None, 0, 'require.config({{baseUrl: "{0}"}});'.format(base or '.')))
+            for url, text in self._modules(base, main_url):
+                size += len(text)
+                lines.extend(self._lines(url, text))
+                lines.append((None, 0, ';'))
+            text = self._read(main_url)
+            size += len(text)
+            lines.extend(self._lines(main_url, text))
+
+        files = len(set(url for url, line, text in lines if url))
+        source_map = SourceMap(posixpath.basename(bundle["output"]))
+        if not (self.minify and self.uglifyjs):
+            if self.minify:
+                self.warnings.append('{0} not minified, uglifyjs is not installed'.format(bundle["output"]))
+            return bundle["output"], files, size, self._write(bundle, lines, source_map)
+
+        # minify the concatenation, mapping it back to the files
+        concat = dict(bundle, output='{0}.concat.js'.format(posixpath.splitext(bundle["output"])[0]))
+        self._write(concat, lines, source_map)
+        out = self._path(bundle["output"])
+        tmp = self._path(concat["output"])
+        try:
+            subprocess.check_call([
+                self.uglifyjs, tmp,
+                '--in-source-map', tmp + '.map',
+                '--source-map', out + '.map',
+                '--source-map-url', posixpath.basename(bundle["output"]) + '.map',
+                '--compress', 'warnings=false', '--mangle',
+                '--output', out])
+        finally:
+            os.remove(tmp)
+            os.remove(tmp + '.map')
+        return bundle["output"], files, size, os.path.getsize(out)
+
+    def _modules(self, base, main_url):
+        '''
+        the modules main requires and the modules they require, dependencies
+        first, named so they can share a file. The paths of the requirejs
+        config of main are followed. Third party libraries in ext directories
+        and plugin, e.g. text!, dependencies are left to requirejs, as are
+        the modules that can't be named.
+        returns [(url, text)]
+        '''
+        main = self._read(main_url)
+        paths = {}
+        for block in PATHS.findall(main):
+            paths.update(PATH.findall(block))
+
+        roots = _static_requires(main)
+        project = os.path.join(self.www_dir, 'theme', 'project.json')
+        if os.path.exists(project):
+            with open(project, 'r') as f:
+                for name in sorted(json.load(f)['plugins']['fieldtrip']):
+                    roots.append('plugins/{0}/js/{0}'.format(name))
+
+        modules = []
+        seen = set()
+
+        def visit(module, parent=None):
+            if module.startswith('.') and parent:
+                module = posixpath.normpath(posixpath.join(posixpath.dirname(parent), module))
+            if module in seen:
+                return
+            url = self._resolve(module, base, paths)
+            if url is None:
+                return
+            seen.add(module)
+            named = _name_module(self._read(url), module)
+            if named is None:
+                self.warnings.append('{0} not bundled, it has no single anonymous define'.format(url))
+                return
+            text, deps = named
+            for dep in deps:
+                visit(dep, module)
+            modules.append((url, text))
+
+        for module in roots:
+            visit(module)
+        return modules
+
+    def _resolve(self, module, base, paths):
+        '''
+        the url of module, None if it isn't bundled
+        '''
+        if '!' in module or module in ('require', 'exports', 'module'):
+            return None
+        path = module
+        for prefix in sorted(paths, key=len, reverse=True):
+            if module == prefix or module.startswith(prefix + '/'):
+                path = paths[prefix] + module[len(prefix):]
+                break
+        url = posixpath.normpath(posixpath.join(base, path + '.js'))
+        if url.startswith('..') or '/ext/' in '/' + url or not os.path.isfile(self._path(url)):
+            return None
+        return url
+
+    def _build_css(self, bundle):
+        lines = []
+        size = 0
+        for url in bundle["files"]:
+            text = self._read(url)
+            size += len(text)
+            lines.extend(self._css_lines(url, text, bundle, set()))
+        files = len(set(url for url, line, text in lines))
+
+        if self.minify:
+            minified = []
+            for url, line, text in lines:
+                text = CSS_SPACE.sub(r'\1', text).strip()
+                text = re.sub(r'\s+', ' ', text)
+                if text:
+                    minified.append((url, line, text))
+            lines = minified
+        source_map = SourceMap(posixpath.basename(bundle["output"]))
+        return bundle["output"], files, size, self._write(bundle, lines, source_map)
+
+    def _css_lines(self, url, text, bundle, importing):
+        '''
+        the lines of a stylesheet with the urls relative to the bundle, the
+        local imports inlined and, when minifying, the comments removed
+        '''
+        importing = importing | set([url])
+        directory = posixpath.dirname(url)
+        bundle_dir = posixpath.dirname(bundle["output"])
+
+        def rebase(match):
+            ref = match.group(2).strip()
+            if ':' in ref or ref.startswith('/') or ref.startswith('#'):
+                return match.group(0)
+            ref = posixpath.relpath(posixpath.normpath(posixpath.join(directory, ref)), bundle_dir)
+            return 'url({0}{1}{0})'.format(match.group(1), ref)
+
+        text = CSS_CHARSET.sub('', text)
+        if self.minify:
+            # keep the lines so the map stays right
+            text = CSS_COMMENT.sub(lambda m: '\n' * m.group(0).count('\n'), text)
+        lines = []
+        for url_line, line, content in self._lines(url, text):
+            imported = CSS_IMPORT.match(content.strip())
+            if imported:
+                ref = posixpath.normpath(posixpath.join(directory, imported.group(1)))
+                if ref not in importing and _is_local(ref, self.www_dir):
+                    lines.extend(self._css_lines(ref, self._read(ref), bundle, importing))
+                    continue
+            lines.append((url_line, line, CSS_URL.sub(rebase, content)))
+        return lines
+
+
+def _static_requires(text):
+    '''
+    the modules of the require([...]) calls of text listing only strings
+    '''
+    modules = []
+    for array in REQUIRE_ARRAY.findall(text):
+        items = array.split(',')
+        matches = [STRING.match(item) for item in items]
+        if all(matches):
+            modules.extend(m.group(1) for m in matches)
+    return modules
+
+
+def _comment_spans(text):
+    spans = []
+    for match in COMMENT.finditer(text):
+        start = match.start() + len(match.group(3) or '')
+        spans.append((start, match.end()))
+    return spans
+
+
+def _name_module(text, module):
+    '''
+    name the anonymous define of a module, giving the dependencies of a
+    define(function(require){...}) module explicitly as requirejs only finds
+    them in the source of the function, which minifying changes
+    returns (text, dependencies), None if text hasn't a single anonymous define
+    '''
+    comments = _comment_spans(text)
+    defines = [m for m in DEFINE.finditer(text)
+               if not any(start <= m.end() - 1 < end for start, end in comments)]
+    if len(defines) != 1:
+        return None
+    at = defines[0].end()
+    rest = text[at:].lstrip()
+    name = "'{0}', ".format(module)
+    if rest[:1] in ('"', "'"):
+        # already named
+        return None
+    if rest.startswith('['):
+        array = rest[1:rest.index(']')]
+        deps = [m.group(1) for m in (STRING.match(item) for item in array.split(',')) if m]
+        return text[:at] + name + text[at:], deps
+
+    function = re.match(r'function\s*[\w$]*\s*\(([^)]*)\)', rest)
+    if function and function.group(1).strip():
+        stripped = COMMENT.sub(lambda m: m.group(3) or '', text)
+        deps = CJS_REQUIRE.findall(stripped)
+        if len([p for p in function.group(1).split(',') if p.strip()]) == 1:
+            explicit = ['require'] + deps
+        else:
+            explicit = ['require', 'exports', 'module'] + deps
+        return text[:at] + name + json.dumps(explicit) + ', ' + text[at:], deps
+    return text[:at] + name + text[at:], []
@@ -0,0 +1,106 @@
+import collections
+import contextlib
+import json
+import os
+import time
+
+
+class BuildTrace(object):
+    '''
+    Timed spans and counters of a build. The spans are kept as complete
+    events of the chrome trace event format so the saved trace can be loaded
+    as a flamegraph by chrome://tracing, speedscope or perfetto. Every span
+    belongs to a stage, e.g. data or render, and the summary adds up the
+    spans of each stage.
+    '''
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.counters = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def span(self, name, stage=None, **args):
+        '''
+        time the block as a span called name, in the stage called name by
+        default, args are shown with the span in the trace viewers
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, stage or name, start, time.time(), **args)
+
+    def add(self, name, stage, start, end, pid=None, **args):
+        '''
+        add a span timed elsewhere, e.g. in a pool worker with pid
+        '''
+        pid = pid or self.pid
+        self.events.append({
+            "name": name,
+            "cat": stage,
+            "ph": "X",
+            "ts": int(start * 1000000),
+            "dur": int((end - start) * 1000000),
+            "pid": pid,
+            "tid": pid,
+            "args": args
+        })
+
+    def count(self, name, value=1):
+        '''
+        add value to the counter name
+        '''
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def stages(self):
+        '''
+        returns {stage: [number of spans, seconds]} in the order the stages
+        started, spans of different stages can contain each other so the
+        stage times don't add up to the build time
+        '''
+        stages = collections.OrderedDict()
+        for event in sorted(self.events, key=lambda e: e["ts"]):
+            stage = stages.setdefault(event["cat"], [0, 0.0])
+            stage[0] += 1
+            stage[1] += event["dur"] / 1000000.0
+        return stages
+
+    def summary(self):
+        '''
+        table of the stages and counters
+        '''
+        lines = ['Stage'.ljust(20) + 'Spans'.rjust(8) + 'Time'.rjust(12)]
+        for stage, (spans, seconds) in self.stages().iteritems():
+            lines.append(stage.ljust(20) + str(spans).rjust(8) + '{0:.1f}ms'.format(seconds * 1000).rjust(12))
+        if self.counters:
+            lines.append('')
+            lines.append('Counter'.ljust(20) + 'Value'.rjust(20))
+            for name, value in self.counters.iteritems():
+                lines.append(name.ljust(20) + str(value).rjust(20))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        '''
+        write the trace as json to path
+        '''
+        d = os.path.dirname(path)
+        if not os.path.exists(d):
+            os.makedirs(d)
+        events = list(self.events)
+        if self.events:
+            end = max(e["ts"] + e["dur"] for e in self.events)
+            events.append({
+                "name": "counters",
+                "ph": "C",
+                "ts": end,
+                "pid": self.pid,
+                "tid": self.pid,
+                "args": dict(self.counters)
+            })
+        with open(path, 'w') as f:
+            json.dump({
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": {"counters": self.counters}
+            }, f)
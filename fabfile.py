@@ -26,6 +26,7 @@ OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 DAMAGE.
 """
 
+from artifact_cache import ArtifactCache, file_sha1, subtree, tree
 from copy import copy, deepcopy
 from configparser import ConfigParser, ExtendedInterpolation, NoOptionError
 from email.mime.image import MIMEImage
@@ -34,20 +35,33 @@ from email.mime.text import MIMEText
 from fabric.api import cd, env, execute, hosts, lcd, local, put, run, settings, task
 from fabric.contrib.files import exists
 from fabric.contrib.project import rsync_project
+from file_watcher import FileWatcher
 from html_generator import HtmlGenerator
 from jinja2 import Environment, FileSystemLoader
+from locale_merger import LocaleMerger
+from locale_usage import LocaleUsage
+from multiprocessing.pool import ThreadPool
+from output_file import write_if_changed
+from vendor import Vendor, VendorError
 
 import xml.etree.ElementTree as ET
 
 import ast
-import codecs
 import datetime
+import html_benchmark
+import html_formatter
 import itertools
 import json
+import log_stats
+import multiprocessing
 import os
 import smtplib
 import sys
 import re
+import shutil
+import threading
+import time
+import traceback
 
 
 CORDOVA_VERSION = '4.3.1'
@@ -61,6 +75,7 @@ NPM_VERSION = '2.11.3'
 BOWER_VERSION = '1.4.1'
 JSHINT_VERSION = '2.8.0'
 PLUGMAN_VERSION = '0.23.1'
+UGLIFYJS_VERSION = '2.6.1'
 
 # lowest supported android sdk version
 # could move to config if projects diverge
@@ -91,6 +106,8 @@ npm_commands = {
 }
 
 config = None
+# access log counts of the stats tasks, by (year, local logs directory)
+_stats_cache = {}
 
 @task
 def check_plugins():
@@ -191,6 +208,7 @@ def clean():
         local('rm {0}*.html'.format(os.sep.join((www, ''))))
         local('rm {0}'.format(os.sep.join((www, 'theme'))))
         local('rm {0}'.format(os.sep.join((root, 'etc', 'config.ini'))))
+        local('rm -rf {0}'.format(os.sep.join((root, 'build'))))
 
     with lcd(root):
         if os.path.exists('project'):
@@ -209,16 +227,116 @@ def clean():
 
 
 @task
-def build(platform='android'):
+def benchmark_formatters(platform='android', repeat=3):
+    """
+    Time the html output formatters on every generated page
+
+    platform - android or ios
+    repeat - the best of repeat runs is reported
+    """
+    root, proj_home, src_dir = _get_source()
+
+    htmlGenerator = HtmlGenerator(
+        platform, False, root, proj_home, src_dir, _config(),
+        _config(None, "settings", folded=True)
+    )
+    formatters = sorted(html_formatter.FORMATTERS.keys())
+    # the script templates aren't formatted by the build
+    pages, templates = htmlGenerator.render()
+    timings = html_formatter.benchmark(pages,
+                                       formatters=formatters,
+                                       repeat=int(repeat))
+
+    print '\n', 'Page'.ljust(25), ''.join([f.ljust(12) for f in formatters]), 'Speedup (html5lib/fast)'
+    totals = dict((f, 0) for f in formatters)
+    for page in sorted(timings.keys()):
+        cols = []
+        for f in formatters:
+            totals[f] += timings[page][f]
+            cols.append('{0:.2f}ms'.format(timings[page][f] * 1000).ljust(12))
+        speedup = timings[page]['html5lib'] / max(timings[page]['fast'], 1e-6)
+        print page.ljust(25), ''.join(cols), '{0:.1f}x'.format(speedup)
+    print 'Total'.ljust(25), ''.join(['{0:.2f}ms'.format(totals[f] * 1000).ljust(12) for f in formatters]), \
+        '{0:.1f}x'.format(totals['html5lib'] / max(totals['fast'], 1e-6))
+
+@task
+def benchmark_html(plugins='1,4,16', pages=2, popups=2, items=10, repeat=3,
+                   jobs=1, formatter='html5lib', save='False', threshold=0.1):
+    """
+    Time the html generation, per stage and end to end, on synthesized trees
+    of the core templates with an increasing number of plugins. The timings
+    are written to build/benchmarks/html.json and compared with the baseline
+    in etc/benchmarks/html.json.
+
+    plugins - comma separated numbers of plugins, one tree for each
+    pages - number of pages of each plugin
+    popups - number of popups added by each plugin
+    items - number of body items in each plugin page json
+    repeat - the best of repeat runs is reported
+    jobs - number of processes rendering pages in the end to end run
+    formatter - html output formatting: html5lib, lxml, fast or none
+    save - store the timings as the new baseline
+    threshold - slowdown ratio reported as a regression
+    """
+    root, proj_home, src_dir = _get_source()
+
+    scenarios = {}
+    for n in plugins.split(','):
+        scenarios['plugins-{0:0>3}'.format(n)] = {
+            'plugins': int(n),
+            'pages': int(pages),
+            'popups': int(popups),
+            'items': int(items)
+        }
+    results = html_benchmark.run(os.path.join(src_dir, 'templates'), scenarios,
+                                 repeat=int(repeat), jobs=int(jobs),
+                                 formatter=formatter)
+
+    print '\n', 'Scenario'.ljust(14), 'Pages'.ljust(7), \
+        ''.join([s.ljust(11) for s in html_benchmark.STAGES])
+    for name, scenario in sorted(results['scenarios'].iteritems()):
+        timings = scenario['timings']
+        print name.ljust(14), str(timings['pages']).ljust(7), \
+            ''.join(['{0:.1f}ms'.format(timings[s] * 1000).ljust(11) for s in html_benchmark.STAGES])
+
+    output = os.path.join(root, 'build', 'benchmarks', 'html.json')
+    html_benchmark.save_baseline(output, results)
+    print '\nTimings written to {0}'.format(output)
+
+    baseline_path = os.path.join(root, 'etc', 'benchmarks', 'html.json')
+    baseline = html_benchmark.load_baseline(baseline_path)
+    if baseline:
+        regressions = 0
+        print '\nCompared with {0}:'.format(baseline_path)
+        for name, stage, before, after, change, regression in html_benchmark.compare(
+                results, baseline, float(threshold)):
+            if regression:
+                regressions += 1
+            print '{0} {1} {2} {3:.1f}ms -> {4:.1f}ms ({5:+.0%})'.format(
+                'REGRESSION' if regression else '          ', name.ljust(14),
+                stage.ljust(10), before * 1000, after * 1000, change)
+        print '{0} regressions'.format(regressions)
+    if _str2bool(save):
+        html_benchmark.save_baseline(baseline_path, results)
+        print 'Baseline saved to {0}'.format(baseline_path)
+
+@task
+def build(platform='android', minify='False', prune_locales='False', bundle='False'):
     """
     Build the app for a specific platform
+
+    platform - android or ios
+    minify - minify the generated html
+    prune_locales - leave the translation keys the app doesn't use out
+    bundle - load the scripts and stylesheets of each page from one file each
     """
 
     _check_commands(['cordova'])
 
-    merge_locales()
     # generate html for android
-    generate_html(platform, cordova=True)
+    generate_html(platform, cordova=True, minify=minify, bundle=bundle)
+    # after the html, the keys it uses are needed to prune the translations
+    merge_locales(prune=prune_locales)
 
     with lcd(_get_runtime()[1]):
         local('cordova build {0}'.format(platform))
@@ -325,24 +443,39 @@ def generate_docs():
     local('jsdox --output docs/ src/www/js/')
 
 @task
-def generate_html(platform="android", cordova=False):
+def generate_html(platform="android", cordova=False, force=False, jobs=1,
+                  formatter='html5lib', minify=False, profile=False,
+                  bundle=False):
     """
     Generate html from templates
 
     platform - android or ios
     cordova - should cordova.js be used?
-    """
-    if isinstance(cordova, basestring):
-        cordova = _str2bool(cordova)
+    force - regenerate all pages, even those whose inputs haven't changed
+    jobs - number of processes rendering pages, 0 for one per cpu
+    formatter - html output formatting: html5lib, lxml, fast or none
+    minify - minify the generated pages and templates, for release builds
+    profile - print the time spent in each stage and save a trace and a
+              cProfile capture in build/profile
+    bundle - load the scripts and stylesheets of each page, and the
+             requirejs modules of the app, from one file each in
+             www/bundles, minified with minify
+    """
+    force = _str2bool(force)
+    minify = _str2bool(minify)
+    profile = _str2bool(profile)
+    bundle = _str2bool(bundle)
 
     #setup paths
     root, proj_home, src_dir = _get_source()
 
-    htmlGenerator = HtmlGenerator(
-        platform, cordova, root, proj_home, src_dir, _config(),
-        _config(None, "settings", folded=True)
-    )
+    htmlGenerator = _get_html_generator(platform, cordova, force=force,
+                                        jobs=jobs, formatter=formatter,
+                                        minify=minify, profile=profile,
+                                        bundle=bundle)
     htmlGenerator.generate()
+    if bundle:
+        _bundle_assets(htmlGenerator.bundler)
     #copy all the editors that exist inside the editors folder of the project
     if os.path.exists(os.path.join(proj_home, 'src', 'editors')):
         local('cp -r {0}/* {1}'.format(os.path.join(proj_home, 'src', 'editors'), os.path.join(src_dir, 'www', 'editors')))
@@ -378,12 +511,19 @@ def install_cordova_plugin(repo, platform='android', target='local'):
         local('cordova plugin add {0}'.format(repo))
 
 @task
-def install_plugins(target='local', cordova="True"):
+def install_plugins(target='local', cordova="True", jobs=4, cache="True"):
     """
-    Set up project plugins
+    Set up project plugins. The git plugins are fetched in parallel, at the
+    same time as the bower plugins, which are fetched together by a single
+    bower install. The cordova plugins are added one at a time. The bower
+    plugins of an exact version and the bower dependencies of the git
+    plugins are kept in build/cache for every version, so they aren't
+    fetched again by later installs.
 
     target - runtime root
     cordova - flag to switch on/off fetching of cordova plugins
+    jobs - number of git plugins fetched at the same time
+    cache - flag to switch on/off the build/cache of the plugins
     """
 
     runtime = _get_runtime(target)[1]
@@ -404,76 +544,264 @@ def install_plugins(target='local', cordova="True"):
     if os.path.exists(json_file):
         pobj = json.loads(open(json_file).read())['plugins']
 
-        if _str2bool(cordova):
-            with lcd(runtime):
-                # do cordova plugins
-                for name in pobj['cordova']:
-                    local('cordova plugin add {0}'.format(name))
-
-        # do fieldtrip plugins
-        proot = os.path.join(root, 'plugins')
-        for plugin, details in pobj['fieldtrip'].iteritems():
-            dest = os.path.join(asset_dir, 'plugins', plugin)
-
-            if details[0:14] == 'https://github':
-                # if repository given in https:// format convert to git@
-                print 'Converting {0} to '.format(details)
-                details = 'git@{0}.git'.format(details[8:]).replace('/', ':', 1)
-
-            if not details[0:3] == 'git':
-                # bower plugin
-                name = 'fieldtrip-{0}'.format(plugin)
-                local('bower install {0}#{1}'.format(name, details))
-                local('mkdir {0}'.format(dest))
-                src = os.path.join(root, 'bower_components', name, 'src', 'www')
-                local('cp -r {0}/* {1}'.format(src, dest))
+        artifacts = None
+        if _str2bool(cache):
+            artifacts = ArtifactCache(os.path.join(root, 'build', 'cache'))
+
+        timings = []
+        failed = threading.Event()
+
+        def install_bower(plugins):
+            # returns a (plugin, seconds, status, output) for every plugin
+            if failed.is_set():
+                return [(plugin, None, 'skipped', '') for plugin, details in plugins]
+            start = time.time()
+            try:
+                output, cached = _install_bower_plugins(plugins, root, asset_dir, artifacts)
+            except PluginInstallError, e:
+                failed.set()
+                output, cached, status = str(e), (), 'failed'
             else:
-                # git repository
-                plugin_src = os.path.join(proot, plugin)
-                if not os.path.isdir(plugin_src):
-                    with lcd(proot):
-                        if '#' in details:
-                            # a branch is defined clone as single branch
-                            repo = details.split('#')
-                            local('git clone -b {0} --single-branch {1} {2}'.format(
-                                repo[1], repo[0], plugin))
-                        else:
-                            # clone whole repo
-                            local('git clone {0} {1}'.format(details, plugin))
-                        with lcd(plugin):
-                            local('ln -s {0} {1}'.format(
-                                os.path.join(root, 'scripts', 'pre-commit.sh'),
-                                os.path.join('.git', 'hooks', 'pre-commit')))
-
-                www = os.path.join(plugin_src, 'src', 'www')
-                if os.path.exists(www):
-                    # create sym link to repos www dir
-                    local('ln -s {0} {1}'.format(www, dest))
-
-                    with lcd(plugin_src):
-                        # install any bower dependencies in plugin
-                        local('bower install')
-                        bower_comps = os.path.join(plugin_src, 'bower_components')
-                        if os.path.exists(bower_comps):
-                            js_ext = os.path.join(www, 'js', 'ext', '')
-                            if not os.path.exists(js_ext):
-                                local('mkdir -p {0}'.format(js_ext))
-                            js_dirs = ['js', 'src', 'dist']
-                            for dep in os.listdir(bower_comps):
-                                for js_dir in js_dirs:
-                                    ext_src = os.path.join(bower_comps,
-                                                           dep, js_dir, '')
-                                    if os.path.exists(ext_src):
-                                        local('cp {0}* {1}'.format(
-                                            ext_src,
-                                            js_ext))
-                else:
-                    print 'Plugin has no www dir: {0}'.format(www)
-                    exit(-1)
+                status = 'ok'
+            # the output of the single bower install is printed once
+            return [(plugin, time.time() - start, 'cached' if plugin in cached else status,
+                     output if i == 0 else '') for i, (plugin, details) in enumerate(plugins)]
+
+        def install_git(plugin, details):
+            if failed.is_set():
+                return [(plugin, None, 'skipped', '')]
+            start = time.time()
+            try:
+                output, cached = _install_git_plugin(plugin, details, root, asset_dir, artifacts)
+                return [(plugin, time.time() - start, 'cached' if cached else 'ok', output)]
+            except PluginInstallError, e:
+                failed.set()
+                return [(plugin, time.time() - start, 'failed', str(e))]
+
+        bower = [(plugin, details) for plugin, details in sorted(pobj['fieldtrip'].items())
+                 if _is_bower_plugin(details)]
+        installs = [(install_git, plugin, details)
+                    for plugin, details in sorted(pobj['fieldtrip'].items())
+                    if not _is_bower_plugin(details)]
+        if bower:
+            installs.insert(0, (install_bower, bower))
+
+        # fail rather than abort in the fetching threads
+        with settings(warn_only=True):
+            pool = ThreadPool(max(1, int(jobs)))
+            try:
+                results = pool.imap_unordered(lambda i: i[0](*i[1:]), installs)
+                if _str2bool(cordova):
+                    with lcd(runtime):
+                        # do cordova plugins, one at a time as they all
+                        # change the runtime
+                        for name in pobj['cordova']:
+                            start = time.time()
+                            out = local('cordova plugin add {0}'.format(name))
+                            timings.append((name, 'cordova', time.time() - start,
+                                            'failed' if out.failed else 'ok'))
+                            if out.failed:
+                                failed.set()
+                                break
+
+                for installed in results:
+                    for plugin, elapsed, status, output in installed:
+                        if status == 'skipped':
+                            timings.append((plugin, 'fieldtrip', None, status))
+                            continue
+                        print 'PLUGIN: {0} {1} in {2:.1f}s'.format(plugin, status, elapsed)
+                        if output:
+                            print output
+                        timings.append((plugin, 'fieldtrip', elapsed, status))
+            finally:
+                pool.close()
+                pool.join()
+
+        print '\n', 'Plugin'.ljust(30), 'Type'.ljust(10), 'Time'.ljust(10), 'Status'
+        for plugin, kind, elapsed, status in timings:
+            print plugin.ljust(30), kind.ljust(10), \
+                ('-' if elapsed is None else '{0:.1f}s'.format(elapsed)).ljust(10), status
+        if failed.is_set():
+            print 'Installing the plugins failed'
+            exit(-1)
     else:
         print 'Where is the plugins file?: {0}'.format(json_file)
         exit(-1)
 
+class PluginInstallError(Exception):
+    pass
+
+def _is_bower_plugin(details):
+    """
+    Is a fieldtrip plugin with these details of project.json fetched from
+    bower rather than from a git repository?
+    """
+    return not (details[0:3] == 'git' or details[0:14] == 'https://github')
+
+def _run_plugin_command(name, cmd, output, cwd=None):
+    """
+    Run a command installing plugins in a thread, so without lcd. The command
+    and its output are added to the list output. Returns the output of the
+    command or raises PluginInstallError with all the output.
+
+    name - the plugins the command is run for
+    cwd - directory the command is run in
+    """
+    if cwd:
+        cmd = 'cd {0} && {1}'.format(cwd, cmd)
+    out = local(cmd, capture=True)
+    output.append('[{0}] {1}'.format(name, cmd))
+    if out:
+        output.append(out)
+    if out.failed:
+        raise PluginInstallError('\n'.join(output + [out.stderr]))
+    return out
+
+def _install_bower_plugins(plugins, root, asset_dir, artifacts=None):
+    """
+    Fetch fieldtrip plugins from bower and copy their www directory into the
+    app. The plugins that aren't in the artifact cache are all fetched by a
+    single bower install. Bower resolves their dependencies together, and
+    only one bower process at a time uses bower_components. Returns the
+    output of the commands and the names of the plugins that came from the
+    artifact cache, or raises PluginInstallError.
+
+    plugins - [(name, bower version)] of the plugins
+    root - fieldtrip root directory
+    asset_dir - the www directory of the app
+    artifacts - ArtifactCache of the plugins of an exact version, None to
+                always fetch them
+    """
+    output = []
+    files = {}
+    fetch = []
+    for plugin, details in plugins:
+        # a range or branch can resolve to other files later, so only
+        # plugins of an exact version are cached
+        version = details if re.match(r'^v?\d+\.\d+\.\d+$', details) else None
+        if artifacts and version:
+            files[plugin] = artifacts.get('fieldtrip-{0}-component'.format(plugin), version)
+        if files.get(plugin) is None:
+            fetch.append((plugin, details, version))
+
+    if fetch:
+        _run_plugin_command(
+            ', '.join(plugin for plugin, details, version in fetch),
+            'bower install {0}'.format(' '.join(
+                'fieldtrip-{0}#{1}'.format(plugin, details) for plugin, details, version in fetch)),
+            output, root)
+
+    fetched = set(plugin for plugin, details, version in fetch)
+    for plugin, details, version in fetch:
+        if artifacts and version:
+            files[plugin] = artifacts.store(
+                'fieldtrip-{0}-component'.format(plugin), version,
+                tree(os.path.join(root, 'bower_components', 'fieldtrip-{0}'.format(plugin))))
+
+    for plugin, details in plugins:
+        component = os.path.join(root, 'bower_components', 'fieldtrip-{0}'.format(plugin))
+        dest = os.path.join(asset_dir, 'plugins', plugin)
+        if plugin not in fetched:
+            # the html generation reads the templates of the plugin in
+            # bower_components
+            if os.path.exists(component):
+                shutil.rmtree(component)
+            artifacts.install(files[plugin], component)
+        if files.get(plugin) is not None:
+            artifacts.install(subtree(files[plugin], 'src/www'), dest)
+        else:
+            _run_plugin_command(plugin, 'mkdir {0}'.format(dest), output)
+            _run_plugin_command(plugin, 'cp -r {0}/* {1}'.format(
+                os.path.join(component, 'src', 'www'), dest), output)
+    return '\n'.join(output), [plugin for plugin, details in plugins if plugin not in fetched]
+
+def _install_git_plugin(plugin, details, root, asset_dir, artifacts=None):
+    """
+    Fetch a fieldtrip plugin from git and link its www directory into the
+    app. It runs in a thread so it doesn't use lcd, and returns the output of
+    the commands and whether the bower dependencies of the plugin came from
+    the artifact cache, or raises PluginInstallError.
+
+    plugin - name of the plugin
+    details - git repository of the plugin
+    root - fieldtrip root directory
+    asset_dir - the www directory of the app
+    artifacts - ArtifactCache of the bower dependencies of the plugin, None
+                to always fetch them
+    """
+    output = []
+    cached = False
+
+    def run(cmd, cwd=None):
+        return _run_plugin_command(plugin, cmd, output, cwd)
+
+    proot = os.path.join(root, 'plugins')
+    dest = os.path.join(asset_dir, 'plugins', plugin)
+
+    if details[0:14] == 'https://github':
+        # if repository given in https:// format convert to git@
+        output.append('Converting {0} to '.format(details))
+        details = 'git@{0}.git'.format(details[8:]).replace('/', ':', 1)
+
+    plugin_src = os.path.join(proot, plugin)
+    if not os.path.isdir(plugin_src):
+        if '#' in details:
+            # a branch is defined clone as single branch
+            repo = details.split('#')
+            run('git clone -b {0} --single-branch {1} {2}'.format(
+                repo[1], repo[0], plugin), proot)
+        else:
+            # clone whole repo
+            run('git clone {0} {1}'.format(details, plugin), proot)
+        run('ln -s {0} {1}'.format(
+            os.path.join(root, 'scripts', 'pre-commit.sh'),
+            os.path.join('.git', 'hooks', 'pre-commit')), plugin_src)
+
+    www = os.path.join(plugin_src, 'src', 'www')
+    if os.path.exists(www):
+        # create sym link to repos www dir
+        run('ln -s {0} {1}'.format(www, dest))
+
+        js_ext = os.path.join(www, 'js', 'ext', '')
+        files = None
+        if artifacts:
+            # the dependencies are the same for a commit unless
+            # bower.json has been changed since
+            version = run('git rev-parse HEAD', plugin_src).strip()
+            bower_json = os.path.join(plugin_src, 'bower.json')
+            if os.path.exists(bower_json):
+                version = '{0}:{1}'.format(version, file_sha1(bower_json))
+            files = artifacts.get('{0}-ext'.format(plugin), version)
+
+        if files is None:
+            # install any bower dependencies in plugin
+            run('bower install', plugin_src)
+            ext = {}
+            bower_comps = os.path.join(plugin_src, 'bower_components')
+            if os.path.exists(bower_comps):
+                js_dirs = ['js', 'src', 'dist']
+                for dep in os.listdir(bower_comps):
+                    for js_dir in js_dirs:
+                        ext_src = os.path.join(bower_comps, dep, js_dir)
+                        if os.path.isdir(ext_src):
+                            for f in os.listdir(ext_src):
+                                if os.path.isfile(os.path.join(ext_src, f)):
+                                    ext[f] = os.path.join(ext_src, f)
+            if artifacts:
+                files = artifacts.store('{0}-ext'.format(plugin), version, ext)
+            else:
+                if ext and not os.path.exists(js_ext):
+                    os.makedirs(js_ext)
+                for f in ext.itervalues():
+                    shutil.copy(f, js_ext)
+        else:
+            cached = True
+        if files:
+            artifacts.install(files, js_ext)
+    else:
+        raise PluginInstallError('Plugin has no www dir: {0}'.format(www))
+    return '\n'.join(output), cached
+
 @task
 def install_project(platform='android',
                     dist_dir='apps',
@@ -502,7 +830,6 @@ def install_project(platform='android',
 
     target_dir, runtime = _get_runtime(target)
     js_ext_dir = os.sep.join(('www', 'js', 'ext'))
-    css_ext_dir = os.sep.join(('www', 'css', 'ext'))
 
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
@@ -547,9 +874,22 @@ def install_project(platform='android',
     _generate_config_xml()
 
     # install external js libraries
-    local('bower install')
-    bower = json.loads(open('bower.json').read())
-    bower_home = os.sep.join((root, 'bower_components'))
+    vendor = Vendor(os.path.join(root, 'bower.json'),
+                    os.path.join(root, 'bower_components'),
+                    os.path.join(src_dir, 'www'),
+                    _config(section='app'),
+                    os.path.join(root, 'build', 'vendor-manifest.json'))
+    if vendor.is_current():
+        print 'VENDOR: bower dependencies unchanged'
+    else:
+        local('bower install')
+        try:
+            copied, unchanged, removed = vendor.vendor()
+        except VendorError, e:
+            print e
+            exit(-1)
+        print 'VENDOR: {0} files copied, {1} unchanged, {2} removed'.format(
+            copied, unchanged, removed)
 
     # install cordova
     install_cordova = True
@@ -611,32 +951,8 @@ def install_project(platform='android',
 
         # clean up old installs
         with settings(warn_only=True):
-            local('rm {0}/*'.format(js_ext_dir))
-            local('rm {0}/*.css'.format(css_ext_dir))
             local('rm {0}/plugins/*'.format(asset_dir))
 
-        # set up bower dependecies
-        for dep in bower['dependency_locations']:
-            files = bower['dependency_locations'][dep]
-            version = bower['dependencies'][dep]
-            for f in files:
-                if version[:4] == 'http':
-                    # if a url has been given get the version from it
-                    version = re.search('((\d\.){2}\d)', version).group(0)
-                f = f.replace('x.x', version)
-                src = os.sep.join((bower_home, dep, f))
-                f_name = dep.replace('-bower', '')
-
-                if (f_name == 'leaflet' or f_name == 'leaflet.marketcluster' or f_name == 'proj4leaflet') and  _config('maplib', section='app') != 'leaflet':
-                    # only install leaflet if required
-                    continue
-
-                if f[len(f) - 2:] == 'js':
-                    dest = os.sep.join((js_ext_dir, '{0}.js'.format(f_name)))
-                else:
-                    dest = os.sep.join((css_ext_dir, '{0}.css'.format(f_name)))
-                local('cp {0} {1}'.format(src, dest))
-
         # install the platform
         if CORDOVA_PLATFORM_VERSION.get(platform):
             local('cordova platform add {0}@{1}'
@@ -664,23 +980,44 @@ def install_project(platform='android',
     if not os.path.exists(dist_path):
         os.makedirs(dist_path)
 
+    built = []
     if _config('maplib', section='app') != 'leaflet':
-        # check if openlayers is installed
-        ol_dir = 'OpenLayers-%s' % OPENLAYERS_VERSION
-        ol_path = os.sep.join((dist_path, ol_dir))
-
-        if not os.path.exists(ol_path):
-            # install openlayers
-            with lcd(dist_path):
-                ol_tar_file_name = '%s.tar.gz' % ol_dir
-                ol_tar = 'http://github.com/openlayers/openlayers/releases/download/release-{0}/{1}'.format(OPENLAYERS_VERSION, ol_tar_file_name)
-                local('wget %s' % ol_tar)
-                local('tar xvfz %s' % ol_tar_file_name)
-
-        with lcd(os.sep.join((ol_path, 'build'))):
-            cfg_file = os.sep.join((src_dir, 'etc', 'openlayers-mobile.cfg'))
-            js_mobile = os.sep.join((runtime, js_ext_dir, 'openlayers.js'))
-            local('./build.py %s %s' % (cfg_file, js_mobile))
+        # the build only changes with the cfg file and the openlayers version
+        cfg_file = os.sep.join((src_dir, 'etc', 'openlayers-mobile.cfg'))
+        artifacts = ArtifactCache(os.path.join(root, 'build', 'cache'))
+        ol_version = '{0}:{1}'.format(OPENLAYERS_VERSION, file_sha1(cfg_file))
+        files = artifacts.get('openlayers', ol_version)
+
+        if files is None:
+            # check if openlayers is installed
+            ol_dir = 'OpenLayers-%s' % OPENLAYERS_VERSION
+            ol_path = os.sep.join((dist_path, ol_dir))
+
+            if not os.path.exists(ol_path):
+                # install openlayers
+                with lcd(dist_path):
+                    ol_tar_file_name = '%s.tar.gz' % ol_dir
+                    ol_tar = 'http://github.com/openlayers/openlayers/releases/download/release-{0}/{1}'.format(OPENLAYERS_VERSION, ol_tar_file_name)
+                    local('wget %s' % ol_tar)
+                    local('tar xvfz %s' % ol_tar_file_name)
+
+            build_dir = _path_join(root, 'build', 'openlayers')
+            js_build = os.sep.join((build_dir, 'openlayers.js'))
+            with lcd(os.sep.join((ol_path, 'build'))):
+                local('./build.py %s %s' % (cfg_file, js_build))
+            files = artifacts.store('openlayers', ol_version,
+                                    {'openlayers.js': js_build})
+            print 'OPENLAYERS: rebuilt {0}'.format(OPENLAYERS_VERSION)
+        else:
+            print 'OPENLAYERS: using the cached build of {0}'.format(OPENLAYERS_VERSION)
+        artifacts.install(files, os.sep.join((runtime, js_ext_dir)))
+        built = ['js/ext/{0}'.format(f) for f in files]
+
+    # remove the builds of the last install that aren't used any more, e.g.
+    # openlayers after switching to leaflet
+    removed = vendor.built(built)
+    if removed:
+        print 'VENDOR: {0} files built by the last install removed'.format(removed)
 
 @task
 def install_project_ios(target='local'):
@@ -696,124 +1033,61 @@ def install_project_android(target='local'):
     install_project(platform='android', target=target)
 
 
-def _find_translations(path):
-    """
-    Scan the path for translations and creates an array with paths where the
-    same combination lang/file was found in the following format:
-        {
-            'en': {
-                'namespace.json': [path1, path2]
-            },
-            'es': {
-                'namespace.json': [path1, path3]
-            }
-        }
-    """
-    list_locales = {}
-
-    if os.path.exists(path):
-        for root, dirs, files in os.walk(path):
-            lang = os.path.relpath(root, path)
-
-            for filename in files:
-                if not filename.endswith('.json'):
-                    continue
-
-                if lang not in list_locales.keys():
-                    list_locales[lang] = {}
-
-                if filename not in list_locales[lang].keys():
-                    list_locales[lang][filename] = []
-
-                list_locales[lang][filename].append(path)
-
-    return list_locales
-
-
-def _concat_translation_paths(dict_a, dict_b={}):
+@task
+def locale_report():
     """
-    Combines two of the dictionaries returned for _find_translations
-    concatenating the array of paths when found
+    Report the translation keys referenced by the generated html and the
+    javascript that are missing from each language, and the keys that
+    aren't referenced. Run generate_html first. The report is also written to
+    build/locales-report.json
     """
-    out_dict = dict.copy(dict_a)
-
-    for lang in dict_b.keys():
-        for filename in dict_b[lang].keys():
-            if lang in out_dict.keys() and filename in out_dict[lang].keys():
-                out_dict[lang][filename].extend(dict_b[lang][filename])
-            else:
-                out_dict[lang][filename] = dict_b[lang][filename]
-
-    return out_dict
-
+    root, proj_home, src_dir = _get_source()
+    localeMerger = _get_locale_merger()
+    usage = _get_locale_usage(localeMerger)
+    report = usage.report(localeMerger.read())
+
+    for lang in sorted(report.keys()):
+        print '\n{0}: {1} missing, {2} unused'.format(
+            lang, len(report[lang]['missing']), len(report[lang]['unused']))
+        for key in report[lang]['missing']:
+            print '  missing {0}'.format(key)
+
+    out = os.path.join(root, 'build', 'locales-report.json')
+    if not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print '\nReport written to {0}'.format(out)
 
 @task
-def merge_locales():
+def merge_locales(force=False, bundle=False, minify=False, prune=False):
     """
     Merge the translations from the core, plugins and project in that order
-    into a cleared www/locales directory
-    """
-
-    root, project, src = _get_source()
-
-    out_dir = os.path.join(src, 'www', 'locales')
-    core_locales_dir = os.path.join(src, 'locales')
-    project_locales_dir = os.path.join(project, 'src', 'locales')
-    plugins_dir = os.path.join(root, plugins)
-
-    # clear the locales output directory
-    with settings(warn_only=True):
-        local('rm -r {0}/*'.format(out_dir))
-
-    # find the translations in for core, plugins and project
-    core_files = _find_translations(core_locales_dir)
-    project_files = _find_translations(project_locales_dir)
-    plugin_files = []
-
-    for plugin in os.listdir(plugins_dir):
-        plugin_dir = os.path.join(plugins_dir, plugin)
-        if os.path.isdir(plugin_dir):
-            plugin_locales_dir = os.path.join(plugin_dir, 'src', 'locales')
-            plugin_files.append(_find_translations(plugin_locales_dir))
-
-    # merge the list of paths
-    locales_paths = _concat_translation_paths(core_files)
-    for plugin_locales in plugin_files:
-        locales_paths = _concat_translation_paths(locales_paths,
-                                                  plugin_locales)
-
-    locales_paths = _concat_translation_paths(locales_paths, project_files)
-
-    # merge and write the translations
-    catalog = {'namespaces': [], 'languages': []}
-    for lang in locales_paths.iterkeys():
-        catalog['languages'].append(lang)
-        for filename, paths in locales_paths[lang].iteritems():
-            out = {}
-            namespace = re.sub('.json$', '', filename)
-            for path in paths:
-                with open(os.path.join(path, lang, filename), 'r') as f:
-                    out.update(json.loads(f.read()))
-            lang_path = os.path.join(out_dir, lang)
-            if not os.path.exists(lang_path):
-                os.mkdir(lang_path)
-
-            with codecs.open(os.path.join(lang_path, filename), 'w', 'utf8') as f:
-                f.write(json.dumps(out, ensure_ascii=False, indent=2))
-
-            if namespace not in catalog['namespaces']:
-                catalog['namespaces'].append(namespace)
-
-    # Write the catalog with the languages and namespaces
-    with codecs.open(os.path.join(out_dir, 'catalog.json'), 'w', 'utf8') as f:
-        f.write(json.dumps(catalog))
+    into the www/locales directory. Only the translations that changed since
+    the last merge are merged again.
+
+    force - clear www/locales and merge all the translations
+    bundle - also write a single file with all the namespaces of each
+             language, so the app loads one file per language
+    minify - write the bundles without whitespace
+    prune - leave out the keys not referenced by the generated html or the
+            javascript, run generate_html first
+    """
+    localeMerger = _get_locale_merger(bundle=_str2bool(bundle),
+                                      minify=_str2bool(minify))
+    if _str2bool(prune):
+        localeMerger.usage = _get_locale_usage(localeMerger)
+    written, unchanged = localeMerger.merge(force=_str2bool(force))
+    print 'LOCALES: {0} files merged, {1} unchanged'.format(written, unchanged)
 
 @task
 def release_android(
         beta='True',
         overwrite='False',
         email=False,
-        fetch_config='True'):
+        fetch_config='True',
+        minify='True',
+        bundle='False'):
     """
     Release android version of fieldtrip app
 
@@ -821,6 +1095,8 @@ def release_android(
     overwrite - should current apk file be overwitten?
     email - send email to ftgb mailing list?
     fetch_config - should remote config be fetched?
+    minify - minify the generated html?
+    bundle - load the scripts and stylesheets of each page from one file each?
     """
 
     _check_commands(['cordova', 'ant', 'zipalign'])
@@ -831,7 +1107,7 @@ def release_android(
     runtime = _get_runtime()[1]
 
     # generate html for android
-    generate_html(cordova=True)
+    generate_html(cordova=True, minify=minify, bundle=bundle)
 
     update_app('android')
 
@@ -923,64 +1199,185 @@ def release_ios():
     print 'Waiting for someone to do this.'
 
 @task
-def stats_usage(year='2015'):
+def stats_usage(year='2015', logs=None, unique_error=None):
     """
     Print out android app start stats by version.
 
     year - collate stats in this year
+    logs - comma separated local directories of access logs to use instead
+           of the servers'
+    unique_error - count the unique ips approximately with this relative
+                   error, e.g. 0.01, see _stats
     """
-    totals = {}
-
-    versions = ['2.3', '4.0', '4.1', '4.2', '4.3', '4.4', '5.0']
-    for version in versions:
-        #fetch_month(version)
-        pattern = 'splash.+Android {0}'.format(version)
-        totals[version] = _stats_monthly(year, pattern)
-    for version, months in totals.iteritems():
+    stats = _stats(year, logs, unique_error)
+    for version in log_stats.ANDROID_VERSIONS:
         print version,':'
-        print 'Month'.ljust(10), 'Unique'.ljust(10), 'Total'.ljust(10)
-        for i, month in months.iteritems():
-            tcount = 0
-            for ip, vals in month.iteritems():
-                tcount = tcount + vals['count']
-            print datetime.date(2014, i, 1).strftime('%B').ljust(10), str(len(month)).ljust(10), str(tcount).ljust(10)
+        _stats_print_months(year, stats.months('android {0}'.format(version), year))
         print '\n'
 
 @task
-def stats_export(year='2015'):
+def stats_export(year='2015', logs=None, unique_error=None):
     """
     Print authoring tool export stats.
 
     year - collate stats in this year
+    logs - comma separated local directories of access logs to use instead
+           of the servers'
+    unique_error - count the unique ips approximately with this relative
+                   error, e.g. 0.01, see _stats
     """
-    totals = {}
-    types = ['geojson', 'kml', 'csv']
-    for type in types:
-        pattern = 'records/dropbox/.+filter=format&frmt={0}'.format(type)
-        totals[type] = _stats_monthly(year, pattern)
-
-    for type, months in totals.iteritems():
+    stats = _stats(year, logs, unique_error)
+    for type in log_stats.EXPORT_FORMATS:
         print type,':'
-        print 'Month'.ljust(10), 'Unique'.ljust(10), 'Total'.ljust(10)
-        for i, month in months.iteritems():
-            tcount = 0
-            for ip, vals in month.iteritems():
-                tcount = tcount + vals['count']
-            print datetime.date(2014, i, 1).strftime('%B').ljust(10), str(len(month)).ljust(10), str(tcount).ljust(10)
+        _stats_print_months(year, stats.months('export {0}'.format(type), year))
         print '\n'
 
 @task
-def stats_uploaded_records(year='2015'):
+def stats_uploaded_records(year='2015', logs=None, unique_error=None):
     """
     Based in the access logs reports the records posted per month
+
+    year - collate stats in this year
+    logs - comma separated local directories of access logs to use instead
+           of the servers'
+    unique_error - count the unique ips approximately with this relative
+                   error, e.g. 0.01, see _stats
     """
-    pattern = 'POST.*?\/pcapi\/records\/dropbox\/.*?\/([^\.]+) HTTP'
-    months = _stats_monthly(year, pattern)
-    for month, ips in months.iteritems():
-        tcount = 0
-        for ip, vals in ips.iteritems():
-            tcount = tcount + vals['count']
-        print datetime.date(int(year), month, 1).strftime('%B').ljust(10), str(tcount).ljust(10)
+    months = _stats(year, logs, unique_error).months('uploaded records', year)
+    for month, tally in months.iteritems():
+        print datetime.date(int(year), month, 1).strftime('%B').ljust(10), str(tally.total).ljust(10)
+
+@task
+def stats_report(start=None, end=None, group_by='month,pattern', patterns=None,
+                 formats='table', output=None, logs=None, unique_error=None):
+    """
+    Report the unique ips and total requests of the stats patterns between
+    two dates, grouped by any of year, month, week, day, host, pattern,
+    version and format. The logs are read once for all the formats, a year
+    at a time, and only the counts of the groups of the report are kept.
+
+    start - first day, yyyy-mm-dd, by default the first day of this year
+    end - last day, yyyy-mm-dd, by default today
+    group_by - comma separated columns to group the requests by
+    patterns - comma separated names of the patterns to include, e.g.
+               'export kml,export csv', all of them by default
+    formats - comma separated output formats: table, csv and json
+    output - path without extension of the csv and json files, by default
+             build/stats/report
+    logs - comma separated local directories of access logs to use instead
+           of the servers'
+    unique_error - count the unique ips approximately with this relative
+                   error, e.g. 0.01, see _stats
+    """
+    today = datetime.date.today()
+    if start:
+        start = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+    else:
+        start = datetime.date(today.year, 1, 1)
+    if end:
+        end = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+    else:
+        end = today
+    group_by = group_by.split(',') if group_by else []
+    if patterns:
+        patterns = patterns.split(',')
+
+    if unique_error is not None:
+        unique_error = float(unique_error)
+
+    try:
+        report = log_stats.Report(log_stats.LogStats(unique_error=unique_error),
+                                  start, end, group_by, patterns)
+    except ValueError, e:
+        print e
+        exit(-1)
+    for year in range(start.year, end.year + 1):
+        # the counts of the days of a year are dropped once added
+        report.add(_stats(year, logs, unique_error, keep=False))
+    rows = report.rows()
+
+    if output is None:
+        output = os.path.join(_get_source()[0], 'build', 'stats', 'report')
+    for fmt in formats.split(','):
+        if fmt == 'table':
+            columns = group_by + ['unique', 'total']
+            widths = [max([len(c)] + [len(str(row[c])) for row in rows]) + 2 for c in columns]
+            print ''.join(c.ljust(w) for c, w in zip(columns, widths))
+            for row in rows:
+                print ''.join(str(row[c]).ljust(w) for c, w in zip(columns, widths))
+        elif fmt in ('csv', 'json'):
+            path = '{0}.{1}'.format(output, fmt)
+            if not os.path.exists(os.path.dirname(os.path.abspath(path))):
+                os.makedirs(os.path.dirname(os.path.abspath(path)))
+            with open(path, 'wb' if fmt == 'csv' else 'w') as f:
+                if fmt == 'csv':
+                    log_stats.write_csv(rows, f)
+                else:
+                    log_stats.write_json(rows, f)
+            print 'STATS: report written to {0}'.format(path)
+        else:
+            print 'Unknown stats format {0}, use table, csv or json'.format(fmt)
+
+@task
+def watch(platform='android', cordova=False, jobs=1, interval=0.5):
+    """
+    Regenerate the html and merge the locales whenever the templates or the
+    translations of core, plugins or project change. Runs until interrupted.
+
+    platform - android or ios
+    cordova - should cordova.js be used?
+    jobs - number of processes rendering pages, 0 for one per cpu
+    interval - seconds between checks when polling for changes
+    """
+    htmlGenerator = _get_html_generator(platform, cordova, jobs=jobs)
+    localeMerger = _get_locale_merger()
+
+    # a merge that failed is done again in full with the next change
+    failed = {'locales': False}
+
+    def rebuild(html, locales, changed=None):
+        start = time.time()
+        if html:
+            try:
+                htmlGenerator.generate()
+            except SystemExit:
+                # keep watching, the problem has been reported
+                print 'WATCH: html generation failed'
+            except Exception:
+                # e.g. a json file or template saved half way through an edit
+                traceback.print_exc()
+                print 'WATCH: html generation failed'
+        if locales or failed['locales']:
+            try:
+                localeMerger.merge(None if failed['locales'] else changed)
+                failed['locales'] = False
+            except Exception:
+                traceback.print_exc()
+                print 'WATCH: merging the locales failed'
+                failed['locales'] = True
+        print 'WATCH: rebuilt in {0:.3f}s'.format(time.time() - start)
+
+    rebuild(True, True)
+
+    template_dirs = [htmlGenerator.templates_path['core'],
+                     htmlGenerator.templates_path['project']] + htmlGenerator.plugin_templates
+    locale_dirs = localeMerger.source_dirs()
+
+    def under(path, dirs):
+        path = os.path.abspath(path)
+        return any(path.startswith(os.path.join(os.path.abspath(d), '')) for d in dirs)
+
+    watcher = FileWatcher(template_dirs + locale_dirs, interval=float(interval))
+    print 'WATCH: watching {0} directories, ctrl-c to stop'.format(len(watcher.paths))
+    try:
+        for changed in watcher.changes():
+            for path in sorted(changed):
+                print 'WATCH: changed {0}'.format(path)
+            rebuild(any(under(p, template_dirs) for p in changed),
+                    any(under(p, locale_dirs) for p in changed),
+                    [p for p in changed if under(p, locale_dirs)])
+    except KeyboardInterrupt:
+        print '\nWATCH: stopped'
 
 @task
 def update_app(platform='android'):
@@ -1234,6 +1631,80 @@ def _get_branch_name(dir):
         current = re.findall(r"^\* .+", out, re.MULTILINE)
         return current[0][2:]
 
+def _bundle_assets(bundler):
+    """
+    Build the bundles of the generated pages and report their sizes. The
+    javascript is minified by uglifyjs if it's installed in node_modules or
+    the path.
+
+    bundler - AssetBundler of the html generator
+    """
+    root = _get_source()[0]
+    uglifyjs = os.path.join(root, 'node_modules', '.bin', 'uglifyjs')
+    if not os.path.exists(uglifyjs):
+        with settings(warn_only=True):
+            uglifyjs = local('command -v uglifyjs', capture=True).strip() or None
+    bundler.uglifyjs = uglifyjs
+
+    sizes = bundler.build()
+    total = [0, 0]
+    for name, files, before, after in sizes:
+        print 'BUNDLE: {0} {1} files, {2:.1f}KB -> {3:.1f}KB'.format(
+            name, files, before / 1024.0, after / 1024.0)
+        total[0] += before
+        total[1] += after
+    if sizes:
+        print 'BUNDLE: {0} bundles, {1:.1f}KB -> {2:.1f}KB'.format(
+            len(sizes), total[0] / 1024.0, total[1] / 1024.0)
+    for warning in bundler.warnings:
+        print 'BUNDLE: {0}'.format(warning)
+    if bundler.minify and not uglifyjs:
+        print 'BUNDLE: install uglifyjs to minify the javascript: npm install uglify-js@{0}'.format(
+            UGLIFYJS_VERSION)
+
+def _get_html_generator(platform, cordova, **kwargs):
+    """
+    Create the html generator for the fieldtrip source directories.
+
+    platform - android or ios
+    cordova - should cordova.js be used?
+    kwargs - HtmlGenerator options, jobs is the number of processes, 0 for
+             one per cpu
+    """
+    if isinstance(cordova, basestring):
+        cordova = _str2bool(cordova)
+    if 'jobs' in kwargs:
+        kwargs['jobs'] = int(kwargs['jobs'])
+        if kwargs['jobs'] < 1:
+            kwargs['jobs'] = multiprocessing.cpu_count()
+
+    root, proj_home, src_dir = _get_source()
+    return HtmlGenerator(
+        platform, cordova, root, proj_home, src_dir, _config(),
+        _config(None, "settings", folded=True),
+        **kwargs
+    )
+
+def _get_locale_merger(**kwargs):
+    """
+    Create the locale merger for the fieldtrip source directories.
+
+    kwargs - LocaleMerger options
+    """
+    root, proj_home, src_dir = _get_source()
+    return LocaleMerger(root, proj_home, src_dir, **kwargs)
+
+def _get_locale_usage(localeMerger):
+    """
+    Scan the generated html and the javascript of the app and plugins for the
+    translation keys they reference.
+
+    localeMerger - the locale merger of the app
+    """
+    root, proj_home, src_dir = _get_source()
+    usage = LocaleUsage(localeMerger.namespaces())
+    return usage.scan(os.path.join(src_dir, 'www'))
+
 def _get_runtime(target='local'):
     """
     Get fieldtrip runtime directories.
@@ -1317,53 +1788,56 @@ def _read_data(fil):
         return filedata
     return None
 
-def _stats_monthly(year, pattern):
-    # calcluate monthly stats based on a grep pattern
-    months = {}
-
-    for i in range(1, 13):
-        month = {}
-
-        logname = "access_log.{0}-{1}*".format(year, str(i).zfill(2))
-        cmd = "find /var/log/httpd/ -name \"{0}\" | xargs grep -P \"{1}\" | awk '{{print $1}}'".format(
-            logname, pattern)
-
-        # get stats from prime
-        host = _config('prime_host', section='common')
-        env.hosts = [host]
-        out = execute('_stats_run_command', cmd)
-        lines = out[host]
-
-        # get stats from backup
-        host = _config('backup_host', section='common')
-        env.hosts = [host]
-        out = execute('_stats_run_command', cmd)
-        lines = lines + out[host]
-
-        for l in lines:
-            if len(l) == 0:
-                continue
-            ip = l.split(':')[1].replace('\r', '')
-
-            # ignore edina ip adresses
-            if ip[:11] == '129.215.169':
-                continue
-
-            if ip in month:
-                month[ip]['count'] = month[ip]['count'] + 1
-            else:
-                month[ip] = {
-                    'number': len(lines),
-                    'count': 1
-                }
-        months[i] = month
-    return months
+def _stats(year, logs=None, unique_error=None, keep=True):
+    """
+    Count the requests of all the stats patterns in the access logs of year
+    of the prime and backup servers, or of the local log directories logs.
+    The servers are read at the same time. The counts of every log are kept
+    in build/stats/index.sqlite so only the logs that are new or changed
+    since the last run are read. They are shared by the stats tasks run by
+    the same fab command.
+
+    The counts are kept per pattern, host and day. Exact counts keep every
+    ip of each of them, so the memory grows with the number of ips. With
+    unique_error a HyperLogLog of at most (1.04 / unique_error)^2 bytes is
+    kept for each instead, so the memory grows with the days of the year
+    but not with the number of ips.
+
+    unique_error - relative error of the approximate unique ips counts, None
+                   for exact counts
+    keep - share the counts with the other stats tasks
+    """
+    if unique_error is not None:
+        unique_error = float(unique_error)
+    key = (str(year), logs, unique_error)
+    if key in _stats_cache:
+        return _stats_cache[key]
+    if logs:
+        sources = [log_stats.LocalLogs(d) for d in logs.split(',')]
+    else:
+        sources = [log_stats.RemoteLogs(host)
+                   for host in [_config('prime_host', section='common'),
+                                _config('backup_host', section='common')]]
+    stats = log_stats.LogStats(unique_error=unique_error)
+    index = log_stats.StatsIndex(os.path.join(_get_source()[0], 'build', 'stats', 'index.sqlite'))
+    try:
+        results = log_stats.collect(index, sources, year, stats)
+    finally:
+        index.close()
+    for host, read in sorted(results.iteritems()):
+        if isinstance(read, Exception):
+            print 'STATS: WARNING {0} not read, using its previous counts: {1}'.format(host, read)
+        else:
+            print 'STATS: {0} logs of {1} read'.format(read, host)
+    if keep:
+        _stats_cache[key] = stats
+    return stats
 
-@task
-def _stats_run_command(cmd):
-    # run stats command and return results in a list
-    out = run(cmd)
-    return out.split('\n')
+def _stats_print_months(year, months):
+    # print the unique ips and total requests of every month
+    print 'Month'.ljust(10), 'Unique'.ljust(10), 'Total'.ljust(10)
+    for i, month in months.iteritems():
+        print datetime.date(int(year), i, 1).strftime('%B').ljust(10), str(month.unique()).ljust(10), str(month.total).ljust(10)
 
 def _str2bool(val):
     """Convert a string representation of truth to true (1) or false (0).
@@ -1428,11 +1902,11 @@ def _update_android_manifest(path):
 def _write_data(fil, filedata):
     """
     fil --> filename
-    filedata --> content that will be written in filename
+    filedata --> content that will be written in filename, the file is
+                 left untouched if it is already its content
+    returns True if the file was written
     """
-    f = open(fil, 'w')
-    f.write(filedata.encode('utf-8'))
-    f.close()
+    return write_if_changed(fil, filedata.encode('utf-8'))
 
 # import any project/plugin tasks
 root, proj_dir, src_dir  = _get_source()
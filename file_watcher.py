@@ -0,0 +1,91 @@
+import os
+import time
+
+
+class FileWatcher(object):
+    """
+    Watch directory trees for changed, added or deleted files. Uses inotify
+    when pyinotify is installed and falls back to polling the modification
+    times otherwise.
+    """
+
+    def __init__(self, paths, interval=0.5, settle=0.1):
+        """
+        paths - directories to watch, those that don't exist are ignored
+        interval - seconds between polls
+        settle - seconds to wait for more changes before reporting them, so
+                 an editor saving several files triggers a single rebuild
+        """
+        self.paths = [p for p in paths if os.path.isdir(p)]
+        self.interval = interval
+        self.settle = settle
+
+    def changes(self):
+        """
+        Generator yielding the set of the paths changed since the last yield
+        """
+        try:
+            import pyinotify
+        except ImportError:
+            print 'WATCH: pyinotify not installed, polling every {0}s'.format(self.interval)
+            return self._poll()
+        return self._inotify(pyinotify)
+
+    def _inotify(self, pyinotify):
+        changed = set()
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if not event.dir:
+                    changed.add(event.pathname)
+
+        wm = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO)
+        for path in self.paths:
+            wm.add_watch(path, mask, rec=True, auto_add=True)
+        notifier = pyinotify.Notifier(wm, Handler())
+        try:
+            while True:
+                if notifier.check_events(timeout=None if not changed else int(self.settle * 1000)):
+                    notifier.read_events()
+                    notifier.process_events()
+                elif changed:
+                    # nothing else happened while settling
+                    yield set(changed)
+                    changed.clear()
+        finally:
+            notifier.stop()
+
+    def _poll(self):
+        snapshot = self._snapshot()
+        while True:
+            time.sleep(self.interval)
+            current = self._snapshot()
+            if current == snapshot:
+                continue
+            time.sleep(self.settle)
+            current = self._snapshot()
+            changed = set(
+                path for path in set(snapshot) | set(current)
+                if snapshot.get(path) != current.get(path))
+            snapshot = current
+            if changed:
+                yield changed
+
+    def _snapshot(self):
+        """
+        {path: (mtime, size)} of every file in the watched trees
+        """
+        files = {}
+        for path in self.paths:
+            for root, dirs, filenames in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for f in filenames:
+                    fullpath = os.path.join(root, f)
+                    try:
+                        st = os.stat(fullpath)
+                    except OSError:
+                        continue
+                    files[fullpath] = (st.st_mtime, st.st_size)
+        return files
@@ -0,0 +1,284 @@
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from html_formatter import format_html
+from html_generator import HtmlGenerator, _render_page
+
+STAGES = ["discovery", "data", "render", "prettify", "write", "total"]
+
+PAGE_TEMPLATE = '''<!DOCTYPE HTML>
+<html>
+  <head>
+    <title>{{header_data["title"]}}</title>
+  </head>
+  <body>
+    <div id="%(name)s-page" data-role="page" data-theme="a">
+      {{header}}
+      <div id="%(name)s-content" class="ui-content" role="main">
+      {%% for key, section in body.iteritems() %%}
+        <div id="%(name)s-{{key}}" class="nav-icons ui-grid-{{ _get_letter(section["items"]) }}">
+        {%% for item, value in section["items"].iteritems() %%}
+          <div {%% for k, v in value["div"].iteritems() %%} {{k}}="{{v}}" {%% endfor %%}>
+            <a {%% for k, v in value["a"].iteritems() %%} {{k}}="{{v}}" {%% endfor %%}>
+              <img {%% for k, v in value["img"].iteritems() %%} {{k}}="{{v}}" {%% endfor %%}>
+            </a>
+            <p data-i18n="{{value["i18n"]}}">{{value["title"]}}</p>
+          </div>
+        {%% endfor %%}
+        </div>
+      {%% endfor %%}
+      </div>
+      {{popups}}
+      {{footer}}
+    </div>
+  </body>
+</html>
+'''
+
+POPUP_TEMPLATE = '''<div id="%(name)s" data-role="popup" data-theme="d">
+  <ul data-role="listview">
+  {%% for key, value in data.iteritems() %%}
+    <li><a href="#" data-value="{{key}}">{{value}}</a></li>
+  {%% endfor %%}
+  </ul>
+</div>
+'''
+
+SETTINGS_TEMPLATE = '''<div class="ui-field-contain" id="%(name)s-settings">
+  <label for="%(name)s-option">%(name)s:</label>
+  <select id="%(name)s-option">
+    <option value="on">On</option>
+    <option value="off">Off</option>
+  </select>
+</div>
+'''
+
+
+def _items(prefix, count):
+    items = {}
+    for i in range(count):
+        items["item{0}".format(i)] = {
+            "div": {"class": "ui-block-{0}".format("abcd"[i % 4])},
+            "a": {"href": "{0}-{1}.html".format(prefix, i), "class": "{0}-link".format(prefix)},
+            "img": {"src": "css/images/{0}-{1}.png".format(prefix, i), "alt": "{0} {1}".format(prefix, i)},
+            "i18n": "{0}:item{1}".format(prefix, i),
+            "title": "{0} {1}".format(prefix, i)
+        }
+    return items
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+
+
+def _write_template(path, template, name):
+    with open(path, 'w') as f:
+        f.write(template % {"name": name})
+
+
+def synthesize(dest, core_templates, plugins=4, pages=2, popups=1, items=10, settings=True):
+    '''
+    create a fieldtrip source tree in dest for benchmarking the html generation
+    dest --> directory of the tree, it is created
+    core_templates --> the core templates directory copied into the tree
+    plugins --> number of plugins
+    pages --> number of pages of each plugin
+    popups --> number of popups each plugin adds to every one of its pages
+               and to the core index page
+    items --> number of body items in the json of each plugin page, this sets
+              the size of the json merged
+    settings --> should the plugins have a settings template?
+    returns the (root, proj_home, src_dir) of the tree
+    '''
+    src_dir = os.path.join(dest, 'src')
+    proj_home = os.path.join(dest, 'project')
+    shutil.copytree(core_templates, os.path.join(src_dir, 'templates'))
+    for d in [os.path.join(src_dir, 'www', 'templates'),
+              os.path.join(src_dir, 'www', 'theme'),
+              os.path.join(proj_home, 'src', 'templates')]:
+        os.makedirs(d)
+
+    names = ["bench{0}".format(i) for i in range(plugins)]
+    _write_json(os.path.join(src_dir, 'www', 'theme', 'project.json'), {
+        "plugins": {
+            "cordova": [],
+            "fieldtrip": dict((name, "git@example.com:{0}.git".format(name)) for name in names)
+        },
+        "versions": {"core": "master", "project": "1.0"}
+    })
+    _write_json(os.path.join(proj_home, 'src', 'templates', 'header.json'), {"title": "Benchmark"})
+    _write_json(os.path.join(proj_home, 'src', 'templates', 'index.json'), {
+        "body": {"section1": {"items": _items("project", items)}}
+    })
+
+    for name in names:
+        templates = os.path.join(dest, 'plugins', name, 'src', 'templates')
+        os.makedirs(templates)
+        popup_data = {}
+        for k in range(popups):
+            popup = "{0}-popup{1}".format(name, k)
+            _write_template(os.path.join(templates, popup + '.html'), POPUP_TEMPLATE, popup)
+            popup_data[popup] = {
+                "template": popup + '.html',
+                "data": dict(("option{0}".format(i), "Option {0}".format(i)) for i in range(items))
+            }
+        # every plugin adds a section and its popups to the core index page
+        _write_json(os.path.join(templates, 'index.json'), {
+            "body": {"{0}-section".format(name): {
+                "title": {"i18n": "{0}:section".format(name), "en": name},
+                "items": _items(name, 2)
+            }},
+            "popups": popup_data
+        })
+        for j in range(pages):
+            page = "{0}-page{1}".format(name, j)
+            _write_template(os.path.join(templates, page + '.html'), PAGE_TEMPLATE, page)
+            _write_json(os.path.join(templates, page + '.json'), {
+                "header": {"title": page},
+                "body": {"section1": {"items": _items(page, items)}},
+                "popups": popup_data
+            })
+        if settings:
+            _write_template(os.path.join(templates, 'settings.html'), SETTINGS_TEMPLATE, name)
+
+    return dest, proj_home, src_dir
+
+
+@contextlib.contextmanager
+def _quiet():
+    '''
+    silence the progress printed by the generator
+    '''
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def _timed(timings, stage, fun, *args):
+    start = time.time()
+    result = fun(*args)
+    timings[stage] = timings.get(stage, 0) + time.time() - start
+    return result
+
+
+def run_stages(generator, formatter):
+    '''
+    resolve, render, prettify and write the pages of generator one stage at a
+    time, returns {stage: seconds}
+    '''
+    timings = {}
+    generator.force = True
+    _timed(timings, "data", generator._resolve_pages)
+    pages, generator._pages = generator._pages, []
+    for page in pages:
+        page["formatter"] = 'none'
+        page["minify"] = False
+        output, error, sizes, spans = _timed(timings, "render", _render_page, page, generator.environments)
+        if error:
+            raise RuntimeError("rendering {0} failed:\n{1}".format(page["output"], error))
+        output = _timed(timings, "prettify", format_html, output, formatter)
+        _timed(timings, "write", generator._write_data, page["output"], output)
+    timings["pages"] = len(pages)
+    return timings
+
+
+def benchmark(root, proj_home, src_dir, repeat=3, jobs=1, formatter='html5lib'):
+    '''
+    time the html generation of a source tree, each stage on its own and
+    generate() end to end. The best of repeat runs is reported.
+    returns {stage: seconds, "pages": number of pages}
+    '''
+    best = {}
+    for i in range(repeat):
+        with _quiet():
+            timings = {}
+            generator = _timed(timings, "discovery", HtmlGenerator,
+                               'android', False, root, proj_home, src_dir,
+                               {"name": "Benchmark"}, None)
+            timings.update(run_stages(generator, formatter))
+
+            generator = HtmlGenerator('android', False, root, proj_home, src_dir,
+                                      {"name": "Benchmark"}, None, force=True,
+                                      jobs=jobs, formatter=formatter)
+            _timed(timings, "total", generator.generate)
+        for stage, value in timings.iteritems():
+            if stage not in best or value < best[stage]:
+                best[stage] = value
+    return best
+
+
+def run(core_templates, scenarios, repeat=3, jobs=1, formatter='html5lib'):
+    '''
+    benchmark every scenario on a synthesized tree
+    scenarios --> {name: synthesize keyword arguments}
+    returns the results, see baseline
+    '''
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "jobs": jobs,
+            "formatter": formatter,
+            "repeat": repeat
+        },
+        "scenarios": {}
+    }
+    for name in sorted(scenarios.keys()):
+        dest = tempfile.mkdtemp(prefix='fieldtrip-benchmark-')
+        try:
+            paths = synthesize(os.path.join(dest, 'tree'), core_templates, **scenarios[name])
+            timings = benchmark(*paths, repeat=repeat, jobs=jobs, formatter=formatter)
+        finally:
+            shutil.rmtree(dest)
+        results["scenarios"][name] = {"parameters": scenarios[name], "timings": timings}
+    return results
+
+
+def load_baseline(path):
+    '''
+    the results stored in path, None if there aren't any
+    '''
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    d = os.path.dirname(path)
+    if not os.path.exists(d):
+        os.makedirs(d)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, threshold=0.1):
+    '''
+    compare results with the baseline
+    threshold --> slowdown ratio above which a stage is a regression
+    returns [(scenario, stage, baseline seconds, seconds, change ratio, regression?)]
+    for the scenarios with the same parameters in both
+    '''
+    rows = []
+    for name, scenario in sorted(results["scenarios"].iteritems()):
+        base = baseline["scenarios"].get(name)
+        if base is None or base["parameters"] != scenario["parameters"]:
+            continue
+        for stage in STAGES:
+            before = base["timings"].get(stage)
+            after = scenario["timings"].get(stage)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            rows.append((name, stage, before, after, change, change > threshold))
+    return rows
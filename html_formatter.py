@@ -0,0 +1,366 @@
+import re
+import time
+from HTMLParser import HTMLParser
+
+# elements that have no closing tag
+VOID_ELEMENTS = set([
+    'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed',
+    'frame', 'hr', 'image', 'img', 'input', 'isindex', 'keygen', 'link',
+    'menuitem', 'meta', 'nextid', 'param', 'source', 'spacer', 'track', 'wbr'
+])
+
+# elements whose content is written untouched
+PRESERVE_ELEMENTS = set(['pre', 'textarea'])
+
+# attributes that hold a list of space separated values
+MULTI_VALUED_ATTRIBUTES = set([
+    'accept-charset', 'accesskey', 'class', 'dropzone', 'headers', 'rel', 'rev'
+])
+
+# attributes whose value can be dropped, e.g. checked="checked" -> checked
+BOOLEAN_ATTRIBUTES = set([
+    'allowfullscreen', 'async', 'autofocus', 'autoplay', 'checked', 'controls',
+    'default', 'defer', 'disabled', 'formnovalidate', 'hidden', 'ismap',
+    'loop', 'multiple', 'muted', 'novalidate', 'open', 'readonly', 'required',
+    'reversed', 'selected'
+])
+
+# elements where the whitespace around their tags isn't rendered
+BLOCK_ELEMENTS = set([
+    'body', 'div', 'fieldset', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'head', 'header', 'html', 'li', 'link', 'meta', 'nav', 'ol', 'option',
+    'p', 'section', 'select', 'table', 'tbody', 'td', 'th', 'thead', 'title',
+    'tr', 'ul'
+])
+
+INDENT = re.compile(r'^(\s*)', re.MULTILINE)
+SCRIPT = re.compile(r'<script[\s>/]', re.IGNORECASE)
+
+# content left untouched by minify: scripts, styles, preformatted text,
+# underscore template code and conditional comments
+MINIFY_PRESERVE = re.compile(
+    r'(<(script|style)\b.*?</\2\s*>)|<(pre|textarea)\b.*?</\3\s*>|<%.*?%>|<!--\[if.*?<!\[endif\]-->',
+    re.DOTALL | re.IGNORECASE)
+MINIFY_SCRIPT = re.compile(r'(<[^>]*>)(.*)(</[^>]*>)$', re.DOTALL)
+MINIFY_PLACEHOLDER = re.compile(r'([\x00\x01])(\d+)\1')
+MINIFY_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+MINIFY_WHITESPACE = re.compile(r'\s+')
+MINIFY_BOOLEAN = re.compile(
+    r'\s({0})=(?:""|\'\'|"\1"|\'\1\')(?=[\s/>])'.format('|'.join(sorted(BOOLEAN_ATTRIBUTES))),
+    re.IGNORECASE)
+MINIFY_BLOCK = re.compile(
+    r' ?(</?(?:{0})\b[^>]*>|\x01\d+\x01) ?'.format('|'.join(sorted(BLOCK_ELEMENTS))),
+    re.IGNORECASE)
+
+
+def format_html(output, formatter='html5lib'):
+    '''
+    format a rendered page
+    output --> the html rendered by jinja
+    formatter --> name of one of the FORMATTERS
+    '''
+    if formatter not in FORMATTERS:
+        raise ValueError("Unknown html formatter {0}, use one of {1}".format(
+            formatter, ", ".join(sorted(FORMATTERS.keys()))))
+    return FORMATTERS[formatter](output)
+
+def prettify(output, parser='html5lib'):
+    '''
+    custom indentation for BeautifulSoup
+    '''
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(output, parser)
+    if len(soup.findAll('script')) > 0:
+        s = soup.prettify()
+    else:
+        s = soup.div.prettify()
+    return INDENT.sub(r'\1\1', s)
+
+def prettify_html5lib(output):
+    return prettify(output, 'html5lib')
+
+def prettify_lxml(output):
+    return prettify(output, 'lxml')
+
+def indent(output):
+    '''
+    streaming indentation that follows the layout of BeautifulSoup.prettify
+    without building a tree. Like prettify, a page without scripts is a
+    fragment and only its first div is kept. Unlike html5lib the markup
+    isn't repaired, e.g. missing html/head/body tags aren't added.
+    '''
+    indenter = _Indenter(fragment=SCRIPT.search(output) is None)
+    indenter.feed(output)
+    indenter.close()
+    return INDENT.sub(r'\1\1', indenter.getvalue())
+
+def unformatted(output):
+    return output
+
+def minify(output):
+    '''
+    collapse whitespace, strip comments and shorten boolean attributes.
+    Whitespace next to block element tags is removed, elsewhere it is
+    collapsed to a single space so the page renders the same.
+    '''
+    preserved = []
+    def preserve(match):
+        if match.group(1):
+            # scripts and styles are block level, the rest are kept inline
+            marker = '\x01'
+            tags = MINIFY_SCRIPT.match(match.group(1))
+            body = tags.group(2)
+            if len(body.strip()) == 0:
+                body = ''
+            preserved.append(MINIFY_WHITESPACE.sub(' ', tags.group(1)) + body + tags.group(3))
+        else:
+            marker = '\x00'
+            preserved.append(match.group(0))
+        return '{0}{1}{0}'.format(marker, len(preserved) - 1)
+
+    s = MINIFY_PRESERVE.sub(preserve, output)
+    s = MINIFY_COMMENT.sub('', s)
+    s = MINIFY_WHITESPACE.sub(' ', s)
+    s = MINIFY_BOOLEAN.sub(r' \1', s)
+    s = s.replace(' />', '/>').replace(' >', '>')
+    s = MINIFY_BLOCK.sub(r'\1', s)
+    s = MINIFY_PLACEHOLDER.sub(lambda m: preserved[int(m.group(2))], s)
+    return s.strip()
+
+def same_structure(html1, html2):
+    '''
+    check two documents parse to the same elements, attributes and text,
+    ignoring comments and differences in whitespace
+    '''
+    return _structure(html1) == _structure(html2)
+
+def _structure(html):
+    '''
+    flatten the html5lib parse tree of html into a list of tokens
+    '''
+    from bs4 import BeautifulSoup
+    from bs4.element import CData, Comment, Declaration, Doctype, ProcessingInstruction, Tag
+
+    tokens = []
+    def walk(node, preserve):
+        for child in node.children:
+            if isinstance(child, Tag):
+                attrs = []
+                for key, value in sorted(child.attrs.items()):
+                    if isinstance(value, list):
+                        value = ' '.join(value)
+                    value = ' '.join(value.split())
+                    if key in BOOLEAN_ATTRIBUTES and value.lower() in ('', key):
+                        value = ''
+                    attrs.append((key, value))
+                tokens.append(('start', child.name, attrs))
+                walk(child, preserve or child.name in PRESERVE_ELEMENTS or child.name in ('script', 'style'))
+                tokens.append(('end', child.name))
+            elif not isinstance(child, (CData, Comment, Declaration, Doctype, ProcessingInstruction)):
+                if len(child.strip()) == 0:
+                    continue
+                text = unicode(child) if preserve else ' '.join(child.split())
+                if tokens and tokens[-1][0] == 'text':
+                    tokens[-1] = ('text', tokens[-1][1] + ' ' + text)
+                else:
+                    tokens.append(('text', text))
+
+    walk(BeautifulSoup(html, 'html5lib'), False)
+    return tokens
+
+FORMATTERS = {
+    'fast': indent,
+    'html5lib': prettify_html5lib,
+    'lxml': prettify_lxml,
+    'none': unformatted
+}
+
+def benchmark(pages, formatters=None, repeat=3):
+    '''
+    time the formatters on rendered pages
+    pages --> {name: html rendered by jinja}
+    formatters --> list of formatter names, all by default
+    repeat --> the best of repeat runs is used
+    returns {name: {formatter: seconds}}
+    '''
+    if formatters is None:
+        formatters = sorted(FORMATTERS.keys())
+    timings = {}
+    for name, output in pages.iteritems():
+        timings[name] = {}
+        for formatter in formatters:
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                format_html(output, formatter)
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            timings[name][formatter] = best
+    return timings
+
+
+class _Indenter(HTMLParser):
+    '''
+    HTMLParser writing each tag, text and comment on its own line indented
+    by its depth, see indent
+    '''
+
+    def __init__(self, fragment=False):
+        HTMLParser.__init__(self)
+        self.fragment = fragment
+        self.started = not fragment
+        self.done = False
+        self.out = []
+        self.stack = []
+        self.text = []
+        # a closing tag is only followed by a newline if something follows it
+        self.pending = False
+        # depth inside a preserved element, e.g. pre
+        self.raw = 0
+
+    def getvalue(self):
+        return u''.join(self.out)
+
+    def close(self):
+        HTMLParser.close(self)
+        self._flush()
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if not self.started:
+            if tag != 'div':
+                return
+            self.started = True
+        if self.done:
+            self._sibling()
+            return
+        if self.raw:
+            self.out.append(u'<{0}{1}>'.format(tag, self._attrs(attrs)))
+            if tag not in VOID_ELEMENTS:
+                self.stack.append(tag)
+                self.raw += 1
+            return
+        self._sibling()
+        self.out.append(u'{0}<{1}{2}{3}>'.format(
+            self._indent(), tag, self._attrs(attrs),
+            '/' if tag in VOID_ELEMENTS else ''))
+        if tag in PRESERVE_ELEMENTS:
+            self.stack.append(tag)
+            self.raw = 1
+        else:
+            self.out.append(u'\n')
+            if tag not in VOID_ELEMENTS:
+                self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if not self.started or self.done or tag not in self.stack:
+            return
+        while self.stack:
+            name = self.stack.pop()
+            if self.raw:
+                self.raw -= 1
+                self.out.append(u'</{0}>'.format(name))
+            else:
+                if self.pending:
+                    self.out.append(u'\n')
+                self.out.append(u'{0}</{1}>'.format(self._indent(), name))
+            self.pending = not self.raw
+            if name == tag:
+                break
+        if self.fragment and not self.stack:
+            self.done = True
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def handle_entityref(self, name):
+        self.text.append(self.unescape(u'&{0};'.format(name)))
+
+    def handle_charref(self, name):
+        self.text.append(self.unescape(u'&#{0};'.format(name)))
+
+    def handle_comment(self, data):
+        self._flush()
+        if not self.started:
+            return
+        if self.done:
+            self._sibling()
+        elif self.raw:
+            self.out.append(u'<!--{0}-->'.format(data))
+        else:
+            self._line(u'<!--{0}-->'.format(data))
+
+    def handle_decl(self, decl):
+        self._flush()
+        if self.started and not self.done:
+            parts = decl.split(None, 1)
+            if len(parts) == 2 and parts[0].upper() == 'DOCTYPE' and len(parts[1].split()) == 1:
+                decl = 'DOCTYPE {0}'.format(parts[1].lower())
+            self._line(u'<!{0}>'.format(decl))
+
+    def _attrs(self, attrs):
+        seen = set()
+        values = []
+        for key, value in attrs:
+            if key in seen:
+                continue
+            seen.add(key)
+            if value is None:
+                value = ''
+            if key in MULTI_VALUED_ATTRIBUTES:
+                value = ' '.join(value.split())
+            value = self._escape(value)
+            if '"' in value:
+                if "'" in value:
+                    value = u'"{0}"'.format(value.replace('"', '&quot;'))
+                else:
+                    value = u"'{0}'".format(value)
+            else:
+                value = u'"{0}"'.format(value)
+            values.append((key, value))
+        if len(values) == 0:
+            return ''
+        return u' ' + u' '.join([u'{0}={1}'.format(k, v) for k, v in sorted(values)])
+
+    def _escape(self, text):
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    def _flush(self):
+        if len(self.text) == 0:
+            return
+        text = u''.join(self.text)
+        self.text = []
+        if not self.started:
+            return
+        if self.done:
+            self._sibling()
+            return
+        if self.stack and self.stack[-1] in ('script', 'style'):
+            escaped = text
+        else:
+            escaped = self._escape(text)
+        if self.raw:
+            self.out.append(escaped)
+        elif len(self.stack) > 0 or self.fragment:
+            self._sibling()
+            if escaped.strip():
+                self._line(escaped.strip())
+
+    def _indent(self):
+        return u' ' * len(self.stack)
+
+    def _line(self, text):
+        self._sibling()
+        self.out.append(u'{0}{1}\n'.format(self._indent(), text))
+
+    def _sibling(self):
+        if self.pending:
+            self.out.append(u'\n')
+            self.pending = False
@@ -1,37 +1,357 @@
 import collections
+import hashlib
 import json
+import multiprocessing
 import os
 import re
 import sys
-from copy import deepcopy
-from bs4 import BeautifulSoup
-from jinja2 import Environment, FileSystemLoader
+import time
+import traceback
+from asset_bundler import AssetBundler, rewrite
+from build_trace import BuildTrace
+from html_formatter import format_html, minify, same_structure
+from json_merge import JsonLayers
+from output_file import write_if_changed
+from jinja2 import ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateSyntaxError, meta
+
+class _Environment(Environment):
+    '''
+    Environment counting the templates it compiles, templates loaded from the
+    bytecode cache aren't compiled
+    '''
+
+    compiled = 0
+
+    def compile(self, *args, **kwargs):
+        self.compiled += 1
+        return Environment.compile(self, *args, **kwargs)
+
+class TemplateEnvironments(object):
+    '''
+    Registry of the jinja environments used in a build, keyed by the tuple of
+    directories they search. An environment with more than one directory is
+    an overlay, e.g. (plugin, core), where the first directory containing a
+    template wins. Compiled templates are shared through an on disk bytecode
+    cache so they are only compiled once across builds and pool workers.
+    '''
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._environments = {}
+
+    def __getstate__(self):
+        # environments can't be pickled, each pool worker creates its own
+        return {"cache_dir": self.cache_dir, "_environments": {}}
+
+    def get(self, paths):
+        '''
+        get the environment searching paths, a directory or a tuple of them
+        '''
+        paths = self.paths(paths)
+        if paths not in self._environments:
+            if len(paths) == 1:
+                loader = FileSystemLoader(paths[0])
+            else:
+                loader = ChoiceLoader([FileSystemLoader(p) for p in paths])
+            bytecode_cache = None
+            if self.cache_dir is not None:
+                if not os.path.exists(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                bytecode_cache = FileSystemBytecodeCache(self.cache_dir)
+            environ = _Environment(loader=loader, bytecode_cache=bytecode_cache)
+            environ.globals["_get_letter"] = HtmlGenerator._get_letter
+            self._environments[paths] = environ
+        return self._environments[paths]
+
+    def compiled(self):
+        '''
+        number of templates compiled by the environments
+        '''
+        return sum(environ.compiled for environ in self._environments.itervalues())
+
+    @staticmethod
+    def paths(paths):
+        '''
+        normalise a directory or a list of them to a tuple
+        '''
+        if isinstance(paths, basestring):
+            return (paths,)
+        return tuple(paths)
+
+_worker_environments = None
+
+def _init_worker(environments):
+    global _worker_environments
+    _worker_environments = environments
+
+def _minify(output):
+    '''
+    minify output if the result parses to the same document.
+    Returns a tuple of (output, (bytes before, bytes after)), the sizes are
+    None if output couldn't be minified.
+    '''
+    minified = minify(output)
+    if not same_structure(output, minified):
+        return output, None
+    return minified, (len(output.encode('utf-8')), len(minified.encode('utf-8')))
+
+def _render_page(page, environments=None):
+    '''
+    render and prettify a page queued by HtmlGenerator._add_page. This runs in
+    the pool workers so it returns the errors instead of raising them.
+    Returns a tuple of (output, error, sizes, timings), see _minify for sizes.
+    timings has the pid of the process, the (stage, start, end) spans of the
+    stages and the number of templates compiled.
+    '''
+    if environments is None:
+        environments = _worker_environments
+    compiled = environments.compiled()
+    timings = {"pid": os.getpid(), "spans": [], "compiled": 0}
+
+    def render(path, name, context):
+        return environments.get(path).get_template(name).render(**context)
+
+    def timed(stage, fun, *args):
+        start = time.time()
+        result = fun(*args)
+        timings["spans"].append((stage, start, time.time()))
+        return result
+
+    def render_all():
+        context = dict(page["context"])
+        for key, (path, name, ctx) in page["partials"].iteritems():
+            context[key] = render(path, name, ctx)
+        for key, items in page["joined"].iteritems():
+            context[key] = "\n".join([render(path, name, ctx) for path, name, ctx in items])
+        path, name = page["template"]
+        return render(path, name, context)
+
+    try:
+        output = timed("render", render_all)
+        output = timed("format", format_html, output, page["formatter"])
+        sizes = None
+        if page["minify"]:
+            output, sizes = timed("minify", _minify, output)
+        return output, None, sizes, timings
+    except Exception:
+        return None, traceback.format_exc(), None, timings
+    finally:
+        timings["compiled"] = environments.compiled() - compiled
+
+
+class BuildManifest(object):
+    '''
+    Persisted record of the content hashes of the inputs used for every
+    generated output. Outputs are grouped by the source file (the page json)
+    that produced them so a whole page can be skipped when nothing it read has
+    changed since the last build.
+    '''
+
+    VERSION = 2
+
+    def __init__(self, path, root, signature, reset=False):
+        self.path = path
+        self.root = root
+        self.signature = signature
+        self.outputs = {}
+        self._hashes = {}
+        self._previous = {}
+        if not reset and os.path.exists(path):
+            with open(path, 'r') as f:
+                try:
+                    manifest = json.load(f)
+                except ValueError:
+                    print "MANIFEST: ignoring unreadable manifest {0}".format(path)
+                    manifest = {}
+            if manifest.get("version") == self.VERSION and manifest.get("signature") == signature:
+                for output, record in manifest["outputs"].iteritems():
+                    self._previous.setdefault(record["source"], {})[output] = record
+
+    def hash_file(self, path):
+        '''
+        sha1 of the file content relative to root, None if it doesn't exist
+        '''
+        if path not in self._hashes:
+            fullpath = os.path.join(self.root, path)
+            if os.path.isfile(fullpath):
+                with open(fullpath, 'rb') as f:
+                    self._hashes[path] = hashlib.sha1(f.read()).hexdigest()
+            else:
+                self._hashes[path] = None
+        return self._hashes[path]
+
+    def is_fresh(self, source, export_path):
+        '''
+        check if all the outputs of source exist and none of their inputs changed
+        '''
+        records = self._previous.get(source)
+        if not records:
+            return False
+        for output, record in records.iteritems():
+            if not os.path.exists(os.path.join(export_path, output)):
+                return False
+            for path, digest in record["inputs"].iteritems():
+                if self.hash_file(path) != digest:
+                    return False
+        return True
+
+    def keep(self, source):
+        '''
+        carry the records of an unchanged source over to the new manifest
+        '''
+        self.outputs.update(self._previous.get(source, {}))
+
+    def discard_source(self, source):
+        '''
+        forget all the outputs of source so the whole source is regenerated
+        on the next build
+        '''
+        for output, record in self.outputs.items():
+            if record["source"] == source:
+                del self.outputs[output]
+
+    def record(self, source, output, inputs):
+        self.outputs[output] = {
+            "source": source,
+            "inputs": dict((path, self.hash_file(path)) for path in inputs)
+        }
+
+    def relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def save(self):
+        d = os.path.dirname(self.path)
+        if not os.path.exists(d):
+            os.makedirs(d)
+        with open(self.path, 'w') as f:
+            json.dump({
+                "version": self.VERSION,
+                "signature": self.signature,
+                "outputs": self.outputs
+            }, f, indent=2, sort_keys=True)
+
 
 class HtmlGenerator(object):
 
-    def __init__(self, platform, cordova, root, proj_home, src_dir, config, settings_config):
+    def __init__(self, platform, cordova, root, proj_home, src_dir, config, settings_config, force=False, jobs=1, formatter='html5lib', minify=False, profile=False, bundle=False):
         self.platform = platform
         self.cordova = cordova
         self.root = root
         self.proj_home = proj_home
         self.src_dir = src_dir
         self.export_path = os.sep.join((src_dir, 'www'))
+        self.build_dir = os.path.join(root, 'build')
         self.plugin_templates = self._get_plugins_templates()
+        #the jinja templates of core, the jinja project templates, the jinja templates of plugins
+        self.templates_path = {
+            "core": os.sep.join((src_dir, 'templates')),
+            "project": os.path.join(proj_home, 'src', 'templates'),
+            "plugins": self.plugin_templates
+        }
+        #built by _resolve_pages, see _index_templates
+        self.template_index = {}
+        self._indexed = set()
         self.config = config
         self.settings_config = settings_config
+        self.force = force
+        self.jobs = jobs
+        self.formatter = formatter
+        self.minify = minify
+        self.profile = profile
+        self.bundle = bundle
+        self.bundler = AssetBundler(self.export_path, os.path.join(self.build_dir, 'bundles'), minify)
+        self.trace = BuildTrace()
+        self.manifest = None
+        self.environments = TemplateEnvironments(os.path.join(self.build_dir, 'jinja'))
+        self.data = JsonLayers()
+        self._pages = []
+        self._minified = []
+        self._shared_inputs = set()
+        self._references = {}
+        self._templates = None
+        self._unit = None
 
     def generate(self):
         '''
-        generate the templates
+        generate the templates. With profile the timings of the stages are
+        printed and saved with a cProfile capture of the main process in
+        build/profile
         '''
-        #the jinja templates of core, the jinja project templates, the jinja templates of plugins
-        templates_path = {
-            "core": os.sep.join((self.src_dir, 'templates')), "project":
-            os.path.join(self.proj_home, 'src', 'templates'),
-            "plugins": self.plugin_templates
-        }
+        self.trace = BuildTrace()
+        if self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        with self.trace.span("generate", "build"):
+            with self.trace.span("resolve", "build"):
+                self._resolve_pages()
+            with self.trace.span("pages", "build"):
+                errors = self._render_pages()
+            with self.trace.span("manifest"):
+                self.manifest.save()
+        if self.profile:
+            profiler.disable()
+            self._save_profile(profiler)
+        print "WRITE: {0} files written, {1} unchanged, {2} sources skipped".format(
+            self.trace.counters.get("files written", 0),
+            self.trace.counters.get("files unchanged", 0),
+            self.trace.counters.get("sources skipped", 0))
+        if self.minify:
+            self._print_minified()
+        if len(errors) > 0:
+            print "There were problems generating {0}".format(", ".join(errors))
+            sys.exit(1)
+
+    def render(self):
+        '''
+        resolve and render all the pages and script templates without
+        formatting or writing them, only the compiled templates are cached in
+        build/jinja as by generate.
+        returns ({html file: rendered html}, {template: rendered template})
+        '''
+        self.force = True
+        self._templates = {}
+        try:
+            self._resolve_pages()
+        finally:
+            templates, self._templates = self._templates, None
+        pages, self._pages = self._pages, []
+        rendered = {}
+        for page in pages:
+            page["formatter"] = 'none'
+            page["minify"] = False
+            output, error, sizes, timings = _render_page(page, self.environments)
+            if error:
+                print "ERROR: rendering {0} failed:\n{1}".format(page["output"], error)
+            else:
+                rendered[os.path.relpath(page["output"], self.export_path)] = output
+        return rendered, templates
+
+    def _resolve_pages(self):
+        '''
+        resolve the data of all the pages and queue them for rendering
+        '''
+        templates_path = self.templates_path
+        #the generator can be kept and run again, e.g. by fab watch, so
+        #forget what was read by the previous run, and what a run that
+        #failed half way through left behind
+        self.data.clear()
+        self._unit = None
+        self._pages = []
+        self._minified = []
+        self._references = {}
+        with self.trace.span("discovery"):
+            self.template_index = self._index_templates()
+            signature = self._get_signature(templates_path)
+        self._shared_inputs = set()
+        self.manifest = BuildManifest(
+            os.path.join(self.build_dir, 'html-manifest.json'),
+            self.root,
+            signature,
+            reset=self.force)
         #generate header footer data firstly
-        header_data, footer_data = self._get_header_footer_data(templates_path)
+        with self.trace.span("header/footer", "data"):
+            header_data, footer_data = self._get_header_footer_data(templates_path)
         #generate the rest
         self._create_html(templates_path["core"], templates_path, header_data, footer_data)
         self._create_html(templates_path["project"], templates_path, header_data, footer_data)
@@ -40,129 +360,218 @@ class HtmlGenerator(object):
         for d in self.plugin_templates:
             self._create_html(d, templates_path, header_data, footer_data)
 
+    def _add_page(self, output, template, context, partials={}, joined={}):
+        '''
+        queue a page for rendering
+        output --> the html file path
+        template --> [path, name] of the page template
+        context --> the template variables
+        partials --> templates rendered into a single variable, {var: [path, name, context]}
+        joined --> lists of templates rendered and joined into a variable
+        '''
+        self._pages.append({
+            "output": output,
+            "template": template,
+            "context": context,
+            "partials": partials,
+            "joined": joined,
+            "formatter": self.formatter,
+            "minify": self.minify,
+            "source": self._unit["source"]
+        })
+        self._unit["outputs"].append(os.path.relpath(output, self.export_path))
+
+    def _begin_unit(self, source):
+        '''
+        start recording the inputs and outputs of a source, return False if
+        its outputs are up to date and it can be skipped
+        '''
+        if self.manifest.is_fresh(source, self.export_path):
+            print "SKIP: {0} unchanged".format(source)
+            self.manifest.keep(source)
+            self.trace.count("sources skipped")
+            return False
+        self._unit = {"source": source, "inputs": set(), "outputs": [], "start": time.time()}
+        return True
+
+    def _end_unit(self):
+        inputs = self._unit["inputs"] | self._shared_inputs
+        for output in self._unit["outputs"]:
+            self.manifest.record(self._unit["source"], output, inputs)
+        self.trace.add(self._unit["source"], "data", self._unit["start"], time.time())
+        self._unit = None
+
+    def _render_pages(self):
+        '''
+        render the queued pages, in parallel if jobs > 1, and write them in
+        the order they were queued. Returns the list of the pages that failed.
+        '''
+        pages, self._pages = self._pages, []
+        self.trace.count("pages", len(pages))
+        if self.jobs > 1 and len(pages) > 1:
+            pool = multiprocessing.Pool(min(self.jobs, len(pages)), _init_worker, (self.environments,))
+            try:
+                results = pool.map(_render_page, pages)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_render_page(page, self.environments) for page in pages]
+
+        errors = []
+        for page, (output, error, sizes, timings) in zip(pages, results):
+            htmlfile = os.path.relpath(page["output"], self.export_path)
+            if timings["spans"]:
+                self.trace.add(htmlfile, "page", timings["spans"][0][1], timings["spans"][-1][2], timings["pid"])
+            for stage, start, end in timings["spans"]:
+                self.trace.add(stage, stage, start, end, timings["pid"], page=htmlfile)
+            self.trace.count("templates compiled", timings["compiled"])
+            if error:
+                print "ERROR: generating {0} failed:\n{1}".format(htmlfile, error)
+                # the other outputs of the source would mark it fresh
+                self.manifest.discard_source(page["source"])
+                errors.append(htmlfile)
+            else:
+                if self.minify:
+                    self._minified.append((htmlfile, sizes))
+                if self.bundle:
+                    output, bundles = rewrite(output, htmlfile, self.export_path)
+                    self.bundler.save_plan(htmlfile, bundles)
+                self._write_data(page["output"], output)
+        return errors
+
     def _check_for_data(self, paths, filename):
         '''
         check if file exists in any of the paths
         '''
-        _in_plugins = []
-        for d in paths["plugins"]:
-            if os.path.exists(os.path.join(d, filename)):
-                _in_plugins.append(d)
-        return _in_plugins
+        return self._check_for_template(filename)
 
     def _check_for_template(self, name):
         '''
-        check if template exists inside the paths
+        get the plugin template directories containing name
         '''
-        res = []
-        for t in self.plugin_templates:
-            if name in os.listdir(t):
-                res.append(t)
-        return res
+        return self.template_index.get(name, {}).get("plugins", [])
 
     def _create_html(self, current_path, paths, header_data, footer_data):
-        environ = Environment(loader=FileSystemLoader(current_path))
-        environ_core = Environment(loader=FileSystemLoader(paths["core"]))
-        environ_project = Environment(loader=FileSystemLoader(paths["project"]))
-        environ.globals["_get_letter"] = self._get_letter
-        environ_project.globals["_get_letter"] = self._get_letter
+        '''
+        resolve the data of every page in current_path, the pages are queued
+        and rendered by _render_pages
+        '''
+        #pages can extend or include core templates
+        overlay = (current_path, paths["core"])
 
-        header_template = environ_core.get_template("header.html")
-        footer_template = environ_core.get_template("footer.html")
+        header_template = self._template_ref(paths["core"], "header.html")
+        footer_template = self._template_ref(paths["core"], "footer.html")
 
         for path, dirs, files in os.walk(current_path):
             for f in files:
                 if self._is_valid_file(f):
                     htmlfile = '{0}.html'.format(f.split(".")[0])
-                    htmlfilepath = os.path.join(path, htmlfile)
                     jsonfilepath = os.path.join(path, f)
 
-                    data = None
-                    if current_path == paths["core"]:
-                        #check if the same json exists in any of the plugins and merge it
-                        data_in_plugins = self._check_for_data(paths, f)
-                        if len(data_in_plugins)>0:
-                            for p in data_in_plugins:
-                                if data == None:
-                                    data = self._get_data(current_path, f, p)
-                                else:
-                                    self._merge(data, self._get_data(current_path, f, p))
-
-                    #merge with the data in json
-                    if data:
-                        self._do_merge(f, data, paths["project"])
-                    else:
-                        data = self._get_data(current_path, f, paths["project"])
-
-                    #generate templates:
-                    if "templates" in data:
-                        self._generate_templates(environ, data["templates"])
-
-                    if os.path.exists(htmlfilepath):
-                        print "generating file {0}".format(htmlfile)
-
-                        if "header" in data:
-                            self._merge(data["header"], header_data)
+                    if not self._begin_unit(self.manifest.relpath(jsonfilepath)):
+                        continue
+
+                    try:
+                        data = None
+                        if current_path == paths["core"]:
+                            #check if the same json exists in any of the plugins and merge it
+                            data_in_plugins = self._check_for_data(paths, f)
+                            if len(data_in_plugins)>0:
+                                for p in data_in_plugins:
+                                    if data == None:
+                                        data = self._get_data(current_path, f, p)
+                                    else:
+                                        data = self._merge(data, self._get_data(current_path, f, p))
+
+                        #merge with the data in json
+                        if data:
+                            data = self._do_merge(f, data, paths["project"])
                         else:
-                            data["header"] = header_data
-
-                        if "footer" in data:
-                            if not self._is_empty(data["footer"]):
-                                footer_data2 = deepcopy(footer_data)
-                                data["footer"] = self._merge(footer_data2, data["footer"])
-                        else:
-                            data["footer"] = footer_data
-
-                        if "body" in data:
-                            body = self._sorted(data["body"])
-                        else:
-                            body=""
-
-                        template = environ.get_template(htmlfile)
-                        indexheader_data = {"cordova": self.cordova, "title": header_data["title"]}
-
-                        popups=[]
-                        if "popups" in data:
-                            for popup in data["popups"]:
-                                res = self._check_for_template(data["popups"][popup]["template"])
-                                if len(res) == 1:
-                                    environ_popup = Environment(loader=FileSystemLoader(res[0]))
-                                    popup_template = environ_popup.get_template(data["popups"][popup]["template"])
-                                    print "POPUP: adding {0} popup from plugins in {1}".format(data["popups"][popup]["template"], htmlfile)
-                                elif len(res) > 1:
-                                    print "There popup template {0} exists more than once. This needs to be fixed.".format(data["popups"][popup]["template"])
-                                    sys.exit()
-                                else:
-                                    popup_template = environ.get_template(data["popups"][popup]["template"])
-                                    print "POPUP: adding {0} popup from core in {1}".format(data["popups"][popup]["template"], htmlfile)
-                                popups.append(popup_template.render(data=data["popups"][popup]["data"]))
-
-                        output = template.render(
-                            header_data=indexheader_data,
-                            body=body,
-                            popups="\n".join(popups),
-                            platform=self.platform,
-                            header=header_template.render(
-                                data=data["header"],
-                                platform=self.platform),
-                            footer=footer_template.render(
-                                    data=data["footer"],
-                                    platform=self.platform))
-                        self._write_data(os.sep.join((self.export_path, htmlfile)), self._prettify(output, 2))
+                            data = self._get_data(current_path, f, paths["project"])
+
+                        #generate templates:
+                        if "templates" in data:
+                            self._generate_templates(overlay, data["templates"])
+
+                        if self._exists(path, htmlfile):
+                            print "generating file {0}".format(htmlfile)
+
+                            #the core/project header overrides the page header
+                            if "header" in data:
+                                header = self._merge(data["header"], header_data)
+                            else:
+                                header = header_data
+
+                            #the page footer overrides the core/project footer, an empty one removes it
+                            if "footer" in data:
+                                footer = data["footer"]
+                                if not self._is_empty(footer):
+                                    footer = self._merge(footer_data, footer)
+                            else:
+                                footer = footer_data
+
+                            if "body" in data:
+                                body = self._sorted(data["body"])
+                            else:
+                                body=""
+
+                            indexheader_data = {"cordova": self.cordova, "title": header_data["title"]}
+
+                            popups=[]
+                            if "popups" in data:
+                                for popup in data["popups"]:
+                                    res = self._check_for_template(data["popups"][popup]["template"])
+                                    if len(res) == 1:
+                                        popup_template = self._template_ref(res[0], data["popups"][popup]["template"])
+                                        print "POPUP: adding {0} popup from plugins in {1}".format(data["popups"][popup]["template"], htmlfile)
+                                    elif len(res) > 1:
+                                        print "There popup template {0} exists more than once. This needs to be fixed.".format(data["popups"][popup]["template"])
+                                        sys.exit()
+                                    else:
+                                        popup_template = self._template_ref(overlay, data["popups"][popup]["template"])
+                                        print "POPUP: adding {0} popup from core in {1}".format(data["popups"][popup]["template"], htmlfile)
+                                    popups.append(popup_template + [{"data": data["popups"][popup]["data"]}])
+
+                            self._add_page(
+                                os.sep.join((self.export_path, htmlfile)),
+                                self._template_ref(overlay, htmlfile),
+                                {
+                                    "header_data": indexheader_data,
+                                    "body": body,
+                                    "platform": self.platform
+                                },
+                                partials={
+                                    "header": header_template + [{"data": header, "platform": self.platform}],
+                                    "footer": footer_template + [{"data": footer, "platform": self.platform}]
+                                },
+                                joined={"popups": popups})
+
+                    finally:
+                        self._end_unit()
 
     def _do_merge(self, filename, data, path):
         '''
         function for merging data tha exist in different places
         e.g.
         '''
-        if os.path.exists(path) and filename in os.listdir(path):
-            with open(os.path.join(path, filename), 'r') as f:
-                new_data = json.load(f, object_pairs_hook=collections.OrderedDict)
+        if self._exists(path, filename):
+            self._track(os.path.join(path, filename))
+            new_data = self.data.load(os.path.join(path, filename))
             print "DATA: merging {0}".format(os.path.join(path, filename))
             return self._merge(data, new_data)
         else:
             return data
 
+    def _exists(self, path, name):
+        '''
+        check if the file name is in the directory path, using the index for
+        the files at the top of the templates directories
+        '''
+        if path in self._indexed and '/' not in name:
+            return path in self.template_index.get(name, {}).get("all", ())
+        return os.path.exists(os.path.join(path, name))
+
     def _find_template(self, name):
         '''
         find template
@@ -177,62 +586,76 @@ class HtmlGenerator(object):
         '''
         generate setttings page
         '''
-        environ = Environment(loader=FileSystemLoader(current_path))
-        settings=[]
-        #get all the settings templates from plugins
-        settings_in_plugins = self._find_template('settings.html')
-        if os.path.exists(os.path.join(paths["project"], 'settings.html')):
-            settings_in_plugins["project"] = paths["project"]
-
-        for plg in settings_in_plugins:
-            settings_path = settings_in_plugins[plg]
-            environ_settings = Environment(loader=FileSystemLoader(settings_path))
-            tmpl = environ_settings.get_template('settings.html')
-            data = {}
-            if self.settings_config is not None:
-                #this is needed for when the plugins come through bower
-                if "fieldtrip-" in plg:
-                    plg = plg.replace("fieldtrip-", "")
-                if plg in self.settings_config.keys():
-                    value = self.settings_config[plg]
-                    if value.startswith('{'):
-                        data = json.loads(value, object_pairs_hook=collections.OrderedDict)
-                    else:
-                        data = value
-            settings.append(tmpl.render(settings=data))
-
-        header_template = environ.get_template("header.html")
-        footer_template = environ.get_template("footer.html")
-        template  = environ.get_template('settings.html')
-        output = template.render(settings="\n".join(settings),
-                            config = self.config,
-                            header=header_template.render(
-                                data=header_data,
-                                platform=self.platform),
-                            footer=footer_template.render(
-                                    data=footer_data,
-                                    platform=self.platform))
-        self._write_data(os.sep.join((self.export_path, 'settings.html')), self._prettify(output, 2))
-
-    def _generate_templates(self, environ, templates):
+        if not self._begin_unit(self.manifest.relpath(os.path.join(current_path, 'settings.html'))):
+            return
+
+        try:
+            settings=[]
+            #get all the settings templates from plugins
+            settings_in_plugins = self._find_template('settings.html')
+            if self._exists(paths["project"], 'settings.html'):
+                settings_in_plugins["project"] = paths["project"]
+
+            for plg in settings_in_plugins:
+                settings_path = settings_in_plugins[plg]
+                tmpl = self._template_ref(settings_path, 'settings.html')
+                data = {}
+                if self.settings_config is not None:
+                    #this is needed for when the plugins come through bower
+                    if "fieldtrip-" in plg:
+                        plg = plg.replace("fieldtrip-", "")
+                    if plg in self.settings_config.keys():
+                        value = self.settings_config[plg]
+                        if value.startswith('{'):
+                            data = json.loads(value, object_pairs_hook=collections.OrderedDict)
+                        else:
+                            data = value
+                settings.append(tmpl + [{"settings": data}])
+
+            self._add_page(
+                os.sep.join((self.export_path, 'settings.html')),
+                self._template_ref(current_path, 'settings.html'),
+                {"config": self.config},
+                partials={
+                    "header": self._template_ref(current_path, "header.html") + [{"data": header_data, "platform": self.platform}],
+                    "footer": self._template_ref(current_path, "footer.html") + [{"data": footer_data, "platform": self.platform}]
+                },
+                joined={"settings": settings})
+        finally:
+            self._end_unit()
+
+    def _generate_templates(self, paths, templates):
         for templ in templates:
             print "TEMPLATE: generating template {0}".format(templates[templ])
-            script_template = environ.get_template(templates[templ])
-            self._write_data(os.path.join(self.export_path, 'templates', templates[templ]), script_template.render())
+            with self.trace.span(templates[templ], "templates"):
+                compiled = self.environments.compiled()
+                script_template = self._get_template(paths, templates[templ])
+                output = script_template.render()
+                self.trace.count("templates compiled", self.environments.compiled() - compiled)
+            if self._templates is not None:
+                # rendering only, see render
+                self._templates[templates[templ]] = output
+                continue
+            if self.minify:
+                with self.trace.span("minify", page=templates[templ]):
+                    output, sizes = _minify(output)
+                self._minified.append((os.path.join('templates', templates[templ]), sizes))
+            self._write_data(os.path.join(self.export_path, 'templates', templates[templ]), output)
 
     def _get_data(self, path1, filename, path2):
         '''
         get data from different two paths and merge them
         '''
-        with open(os.path.join(path1, filename),'r') as f:
-            try:
-                json_object = json.load(f, object_pairs_hook=collections.OrderedDict)
-                return self._do_merge(filename, json_object, path2)
-            except ValueError, e:
-                print "There was problem with the json file {0}".format(os.path.join(path1, filename))
-                sys.exit()
-
-    def _get_letter(self, obj):
+        self._track(os.path.join(path1, filename))
+        try:
+            json_object = self.data.load(os.path.join(path1, filename))
+        except ValueError, e:
+            print "There was problem with the json file {0}".format(os.path.join(path1, filename))
+            sys.exit()
+        return self._do_merge(filename, json_object, path2)
+
+    @staticmethod
+    def _get_letter(obj):
         '''
         Get the letter that corresponds to column in a jqm grid view based on the
         number of elements in obj: see http://api.jquerymobile.com/1.3/grid-layout/
@@ -251,13 +674,89 @@ class HtmlGenerator(object):
         '''
         header_data = self._get_data(templates_path["core"], 'header.json', templates_path["project"])
         footer_data = self._get_data(templates_path["core"], 'footer.json', templates_path["project"])
-        for d in templates_path["plugins"]:
-            if os.path.exists(os.path.join(d, 'header.json')):
-                self._do_merge('header.json', header_data, d)
-            if os.path.exists(os.path.join(d, 'footer.json')):
-                self._do_merge('footer.json', footer_data, d)
+        for d in self._check_for_template('header.json'):
+            header_data = self._do_merge('header.json', header_data, d)
+        for d in self._check_for_template('footer.json'):
+            footer_data = self._do_merge('footer.json', footer_data, d)
         return header_data, footer_data
 
+    def _get_signature(self, templates_path):
+        '''
+        hash of everything that affects all the outputs: the generator options
+        and the list of files in every templates directory, so adding or
+        removing a template/json forces a full rebuild
+        '''
+        files = []
+        for d in [templates_path["core"], templates_path["project"]] + templates_path["plugins"]:
+            for path, dirs, filenames in os.walk(d):
+                for f in filenames:
+                    files.append(os.path.relpath(os.path.join(path, f), self.root))
+        signature = json.dumps([
+            BuildManifest.VERSION,
+            self.platform,
+            self.cordova,
+            self.formatter,
+            self.minify,
+            self.bundle,
+            self.config,
+            self.settings_config,
+            sorted(files)
+        ], sort_keys=True)
+        return hashlib.sha1(signature).hexdigest()
+
+    def _get_template(self, paths, name):
+        '''
+        get a jinja template of the directories paths and record its source
+        as an input
+        '''
+        template = self.environments.get(paths).get_template(name)
+        self._track_template(TemplateEnvironments.paths(paths), name)
+        return template
+
+    def _template_ref(self, paths, name):
+        '''
+        reference to a template rendered later by _render_page
+        '''
+        paths = TemplateEnvironments.paths(paths)
+        self._track_template(paths, name)
+        return [paths, name]
+
+    def _track_template(self, paths, name, seen=None):
+        '''
+        record the template name of the directories paths as an input, and
+        the templates it includes, extends or imports, which are looked up
+        in paths in the same order as by the jinja loader
+        '''
+        if seen is None:
+            seen = set()
+        found = [p for p in paths if self._exists(p, name)]
+        path = os.path.join(found[0] if len(found) > 0 else paths[0], *name.split('/'))
+        if path in seen:
+            return
+        seen.add(path)
+        self._track(path)
+        for referenced in self._referenced_templates(paths, path):
+            self._track_template(paths, referenced, seen)
+
+    def _referenced_templates(self, paths, path):
+        '''
+        the names of the templates the template file path includes, extends
+        or imports, names only known when rendering are left out
+        '''
+        if path not in self._references:
+            names = []
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    source = f.read().decode('utf-8')
+                try:
+                    ast = self.environments.get(paths).parse(source)
+                    names = [n for n in meta.find_referenced_templates(ast) if n is not None]
+                except TemplateSyntaxError:
+                    # reported when the page is rendered
+                    pass
+            self._references[path] = names
+        return self._references[path]
+
     def _get_plugins_templates(self):
         '''
         get a list of directories with templates
@@ -285,6 +784,26 @@ class HtmlGenerator(object):
                         plugins_list.append(os.path.join('bower_components', 'fieldtrip-{0}'.format(k), 'src', 'templates'))
         return plugins_list
 
+    def _index_templates(self):
+        '''
+        index the files of the core, project and plugin templates directories,
+        returns {filename: {"all": set of directories, "plugins": [plugin directories]}}
+        '''
+        index = {}
+        self._indexed = set()
+        dirs = [self.templates_path["core"], self.templates_path["project"]] + self.plugin_templates
+        for d in dirs:
+            self._indexed.add(d)
+            if not os.path.isdir(d):
+                continue
+            is_plugin = d in self.plugin_templates
+            for name in os.listdir(d):
+                entry = index.setdefault(name, {"all": set(), "plugins": []})
+                entry["all"].add(d)
+                if is_plugin:
+                    entry["plugins"].append(d)
+        return index
+
     def _is_empty(self, any_structure):
         # TODO
         if any_structure:
@@ -295,38 +814,45 @@ class HtmlGenerator(object):
     def _is_valid_file(self, f):
         return f.endswith("json") and not f in ["header.json", "footer.json", "settings.json"]
 
-    def _merge(self, a, b, path=None):
-        '''
-        merges b into a
-        #http://stackoverflow.com/questions/7204805/python-dictionaries-of-dictionaries-merge
-        '''
-        if path is None: path = []
-        for key in b:
-            if key in a:
-                if isinstance(a[key], dict) and isinstance(b[key], dict):
-                    if self._is_empty(b[key]):
-                        a[key] = b[key]
-                    else:
-                        self._merge(a[key], b[key], path + [str(key)])
-                elif a[key] == b[key]:
-                    pass # same leaf value
-                else:
-                    a[key] = b[key]
+    def _merge(self, a, b):
+        '''
+        returns b merged into a, see json_merge.merge
+        '''
+        return self.data.merge(a, b)
+
+    def _print_minified(self):
+        '''
+        report the bytes saved by minifying each file
+        '''
+        before = after = 0
+        for name, sizes in self._minified:
+            if sizes is None:
+                print "MINIFY: {0} not minified, the minified document didn't match the original".format(name)
             else:
-                a[key] = b[key]
-        return a
+                before += sizes[0]
+                after += sizes[1]
+                print "MINIFY: {0} {1} -> {2} bytes, saved {3}".format(name, sizes[0], sizes[1], sizes[0] - sizes[1])
+        print "MINIFY: total {0} -> {1} bytes, saved {2}".format(before, after, before - after)
+        self._minified = []
 
-    def _prettify(self, output, indent='2'):
+    def _save_profile(self, profiler):
         '''
-        custom indentation for BeautifulSoup
+        print the stages and the slowest functions, and save the trace and the
+        cProfile stats in build/profile
         '''
-        soup = BeautifulSoup(output, "html5lib")
-        if len(soup.findAll('script')) > 0:
-            s = soup.prettify()
-        else:
-            s = soup.div.prettify()
-        r = re.compile(r'^(\s*)', re.MULTILINE)
-        return r.sub(r'\1\1', s)
+        import pstats
+        profile_dir = os.path.join(self.build_dir, 'profile')
+        self.trace.count("json files read", self.data.files_read)
+        trace_file = os.path.join(profile_dir, 'html-trace.json')
+        self.trace.save(trace_file)
+        stats_file = os.path.join(profile_dir, 'html.prof')
+        profiler.dump_stats(stats_file)
+
+        print "\nPROFILE: stages\n{0}\n".format(self.trace.summary())
+        print "PROFILE: slowest functions of the main process"
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+        print "PROFILE: trace written to {0}, load it in chrome://tracing or speedscope".format(trace_file)
+        print "PROFILE: cProfile stats written to {0}".format(stats_file)
 
     def _sorted(self, dic):
         '''
@@ -336,11 +862,29 @@ class HtmlGenerator(object):
         dic = collections.OrderedDict(sorted(dic.items(), key=lambda t: t[0]))
         return dic
 
+    def _track(self, path):
+        '''
+        record path as an input of the current source, or of every source if
+        read outside one (header/footer)
+        '''
+        path = self.manifest.relpath(path)
+        if self._unit is None:
+            self._shared_inputs.add(path)
+        else:
+            self._unit["inputs"].add(path)
+
     def _write_data(self, fil, filedata):
         '''
         fil --> filename
         filedata --> content that will be written in filename
         '''
-        f = open(fil, 'w')
-        f.write(filedata.encode('utf-8'))
-        f.close()
+        if self._unit is not None:
+            self._unit["outputs"].append(os.path.relpath(fil, self.export_path))
+        with self.trace.span("write", path=os.path.relpath(fil, self.export_path)):
+            data = filedata.encode('utf-8')
+            written = write_if_changed(fil, data)
+        if written:
+            self.trace.count("files written")
+            self.trace.count("bytes written", len(data))
+        else:
+            self.trace.count("files unchanged")
@@ -0,0 +1,89 @@
+import collections
+import json
+
+
+class FrozenOrderedDict(collections.OrderedDict):
+    '''
+    OrderedDict that can't be modified once created, so merged data can
+    safely share its values with the fragments it was merged from
+    '''
+
+    def __init__(self, *args, **kwargs):
+        collections.OrderedDict.__init__(self, *args, **kwargs)
+        self._frozen = True
+
+    def __setitem__(self, key, value, *args, **kwargs):
+        if getattr(self, '_frozen', False):
+            self._immutable()
+        collections.OrderedDict.__setitem__(self, key, value, *args, **kwargs)
+
+    def __delitem__(self, key, *args, **kwargs):
+        if getattr(self, '_frozen', False):
+            self._immutable()
+        collections.OrderedDict.__delitem__(self, key, *args, **kwargs)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('{0} can not be modified'.format(type(self).__name__))
+
+    clear = pop = popitem = setdefault = update = _immutable
+
+
+def merge(a, b):
+    '''
+    merge b into a without modifying either of them:
+    - keys of b replace the keys of a, new keys are added after the keys of a
+    - when both values are dicts they are merged recursively, unless the
+      value in b is empty which replaces the value in a
+    - any other value in b, lists included, replaces the value in a
+    values that aren't merged are shared with a and b rather than copied
+    '''
+    if len(b) == 0:
+        return a
+    items = collections.OrderedDict(a)
+    for key, value in b.iteritems():
+        if key in items and isinstance(items[key], dict) and isinstance(value, dict) and len(value) > 0:
+            items[key] = merge(items[key], value)
+        else:
+            items[key] = value
+    return FrozenOrderedDict(items)
+
+
+class JsonLayers(object):
+    '''
+    Loads the json fragments of core, plugins and project and merges them.
+    Every file is parsed once and every merge of the same two fragments is
+    done once, so e.g. the header data merged into many pages is shared
+    rather than copied for each of them.
+    '''
+
+    def __init__(self):
+        self._files = {}
+        self._merges = {}
+        self.files_read = 0
+
+    def load(self, path):
+        '''
+        parse the json file path, raises ValueError if it isn't valid
+        '''
+        if path not in self._files:
+            with open(path, 'r') as f:
+                self._files[path] = json.load(f, object_pairs_hook=FrozenOrderedDict)
+            self.files_read += 1
+        return self._files[path]
+
+    def merge(self, a, b):
+        '''
+        memoised merge of b into a, see merge
+        '''
+        key = (id(a), id(b))
+        if key not in self._merges:
+            # keep a and b so their ids aren't reused
+            self._merges[key] = (a, b, merge(a, b))
+        return self._merges[key][2]
+
+    def clear(self):
+        '''
+        forget the parsed files and merges, e.g. after the files changed
+        '''
+        self._files = {}
+        self._merges = {}
@@ -0,0 +1,316 @@
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+from output_file import write_if_changed
+
+
+def _find_translations(dirs):
+    """
+    Index the translations of the locales directories dirs in a single pass.
+    Returns the directories containing each combination of lang/file, in
+    the order of dirs, which is the order they are merged in:
+        {
+            'en': {
+                'namespace.json': [path1, path2]
+            },
+            'es': {
+                'namespace.json': [path1, path3]
+            }
+        }
+    Only the json files of the lang directories are translations, anything
+    else is ignored.
+    """
+    list_locales = {}
+
+    for path in dirs:
+        if not os.path.isdir(path):
+            continue
+        for lang in sorted(os.listdir(path)):
+            lang_path = os.path.join(path, lang)
+            if not os.path.isdir(lang_path):
+                continue
+            for filename in sorted(os.listdir(lang_path)):
+                if filename.endswith('.json') and os.path.isfile(os.path.join(lang_path, filename)):
+                    list_locales.setdefault(lang, {}).setdefault(filename, []).append(path)
+
+    return list_locales
+
+
+class LocaleMerger(object):
+    """
+    Merge the translations from the core, plugins and project in that order
+    into the www/locales directory. The sha1 of the translation files merged
+    into every output is recorded in build/locales-manifest.json so only the
+    outputs whose translations changed are merged again.
+
+    With bundle a single file with all the namespaces of a language is also
+    written for each language, named <lang>.<content hash>.json and listed
+    in the bundles of the catalog, so the app reads one file per language.
+
+    With usage the keys that the app doesn't reference are left out of the
+    merged files, see locale_usage.LocaleUsage.
+    """
+
+    VERSION = 2
+    BUNDLE = re.compile(r'^(?P<lang>.+)\.[0-9a-f]{10}\.json$')
+
+    def __init__(self, root, proj_home, src_dir, bundle=False, minify=False, usage=None):
+        """
+        bundle - write a bundle of all the namespaces of every language
+        minify - write the bundles without whitespace
+        usage - LocaleUsage of the app used to prune the unused keys
+        """
+        self.root = root
+        self.bundle = bundle
+        self.minify = minify
+        self.usage = usage
+        self.out_dir = os.path.join(src_dir, 'www', 'locales')
+        self.core_dir = os.path.join(src_dir, 'locales')
+        self.project_dir = os.path.join(proj_home, 'src', 'locales')
+        self.plugins_dir = os.path.join(root, 'plugins')
+        self.manifest_path = os.path.join(root, 'build', 'locales-manifest.json')
+
+    def source_dirs(self):
+        """
+        The locales directories of core, the plugins and the project in the
+        order their translations are merged, the plugins sorted by name so a
+        plugin overriding the key of another always does
+        """
+        dirs = [self.core_dir]
+        if os.path.exists(self.plugins_dir):
+            for plugin in sorted(os.listdir(self.plugins_dir)):
+                plugin_dir = os.path.join(self.plugins_dir, plugin)
+                if os.path.isdir(plugin_dir):
+                    dirs.append(os.path.join(plugin_dir, 'src', 'locales'))
+        dirs.append(self.project_dir)
+        return dirs
+
+    def merge(self, changed=None, force=False):
+        """
+        Merge the translations whose files changed since the last merge and
+        update the catalog of languages and namespaces. Returns the number of
+        (written, unchanged) merged files.
+
+        changed - list of changed translation files, when given only the
+                  merged files they are part of are checked
+        force - clear the output directory and merge everything
+        """
+        if force:
+            self._clear()
+        manifest = {} if force else self._load_manifest()
+        affected = None if changed is None else self._affected(changed)
+
+        locales_paths = self._find_locales()
+        outputs = {}
+        written = unchanged = 0
+        for lang in sorted(locales_paths.iterkeys()):
+            for filename, paths in sorted(locales_paths[lang].iteritems()):
+                output = '{0}/{1}'.format(lang, filename)
+                if affected is not None and (lang, filename) not in affected and output in manifest:
+                    outputs[output] = manifest[output]
+                    continue
+                sources = {
+                    "sources": self._hash_sources(lang, filename, paths),
+                    "usage": self.usage.digest() if self.usage else None
+                }
+                if (manifest.get(output) == sources and
+                        os.path.exists(os.path.join(self.out_dir, lang, filename))):
+                    unchanged += 1
+                else:
+                    self._write_namespace(lang, filename, paths)
+                    written += 1
+                outputs[output] = sources
+
+        # remove the merged files whose translations were all deleted
+        for output in manifest:
+            if output not in outputs:
+                path = os.path.join(self.out_dir, *output.split('/'))
+                if os.path.exists(path):
+                    os.remove(path)
+
+        bundles = self._write_bundles(locales_paths) if self.bundle else {}
+        self._remove_bundles(bundles)
+        self._update_catalog(locales_paths, bundles)
+        self._save_manifest(outputs)
+        return written, unchanged
+
+    def _affected(self, changed):
+        """
+        The (lang, filename) of the changed translation files
+        """
+        affected = set()
+        dirs = self.source_dirs()
+        for path in changed:
+            for d in dirs:
+                rel = os.path.relpath(os.path.abspath(path), d)
+                if not rel.startswith(os.pardir) and rel.endswith('.json'):
+                    affected.add((os.path.dirname(rel), os.path.basename(rel)))
+        return affected
+
+    def _find_locales(self):
+        """
+        find the translations in for core, plugins and project
+        """
+        return _find_translations(self.source_dirs())
+
+    def _clear(self):
+        """
+        clear the locales output directory
+        """
+        if os.path.exists(self.out_dir):
+            for name in os.listdir(self.out_dir):
+                path = os.path.join(self.out_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+    def namespaces(self):
+        """
+        the namespaces of the translations of core, plugins and project
+        """
+        namespaces = set()
+        for files in self._find_locales().itervalues():
+            namespaces.update(re.sub('.json$', '', filename) for filename in files)
+        return sorted(namespaces)
+
+    def read(self):
+        """
+        the merged translations before pruning, {lang: {namespace: translations}}
+        """
+        locales = {}
+        for lang, files in self._find_locales().iteritems():
+            locales[lang] = {}
+            for filename, paths in files.iteritems():
+                locales[lang][re.sub('.json$', '', filename)] = self._merged(lang, filename, paths)
+        return locales
+
+    def _hash_sources(self, lang, filename, paths):
+        """
+        {translation file relative to root: sha1} of the files merged into
+        lang/filename
+        """
+        sources = {}
+        for path in paths:
+            source = os.path.join(path, lang, filename)
+            with open(source, 'rb') as f:
+                sources[os.path.relpath(source, self.root)] = hashlib.sha1(f.read()).hexdigest()
+        return sources
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as f:
+            try:
+                manifest = json.load(f)
+            except ValueError:
+                return {}
+        if manifest.get("version") != self.VERSION or manifest.get("out_dir") != self.out_dir:
+            return {}
+        return manifest["outputs"]
+
+    def _save_manifest(self, outputs):
+        d = os.path.dirname(self.manifest_path)
+        if not os.path.exists(d):
+            os.makedirs(d)
+        self._write(self.manifest_path, json.dumps({
+            "version": self.VERSION,
+            "out_dir": self.out_dir,
+            "outputs": outputs
+        }, indent=2, sort_keys=True))
+
+    def _update_catalog(self, locales_paths, bundles):
+        """
+        update the catalog of languages and namespaces, keeping the order of
+        the existing entries and adding the new ones at the end, and set the
+        bundles of the languages
+        """
+        languages = set(locales_paths.iterkeys())
+        namespaces = set()
+        for files in locales_paths.itervalues():
+            for filename in files:
+                namespaces.add(re.sub('.json$', '', filename))
+
+        catalog_path = os.path.join(self.out_dir, 'catalog.json')
+        catalog = {'namespaces': [], 'languages': []}
+        if os.path.exists(catalog_path):
+            with open(catalog_path, 'r') as f:
+                try:
+                    catalog = json.load(f)
+                except ValueError:
+                    pass
+
+        for key, entries in (('languages', languages), ('namespaces', namespaces)):
+            current = [e for e in catalog.get(key, []) if e in entries]
+            catalog[key] = current + sorted(entries - set(current))
+        if bundles:
+            catalog['bundles'] = bundles
+        else:
+            catalog.pop('bundles', None)
+
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        # Write the catalog with the languages and namespaces
+        self._write(catalog_path, json.dumps(catalog))
+
+    def _write_bundles(self, locales_paths):
+        """
+        write the bundle of every language from the merged namespaces,
+        returns {lang: bundle filename}
+        """
+        bundles = {}
+        for lang in sorted(locales_paths.iterkeys()):
+            bundle = collections.OrderedDict()
+            for filename in sorted(locales_paths[lang].iterkeys()):
+                with open(os.path.join(self.out_dir, lang, filename), 'r') as f:
+                    bundle[re.sub('.json$', '', filename)] = json.load(
+                        f, object_pairs_hook=collections.OrderedDict)
+            if self.minify:
+                data = json.dumps(bundle, ensure_ascii=False, separators=(',', ':'))
+            else:
+                data = json.dumps(bundle, ensure_ascii=False, indent=2)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            bundles[lang] = '{0}.{1}.json'.format(lang, hashlib.sha1(data).hexdigest()[:10])
+            self._write(os.path.join(self.out_dir, bundles[lang]), data)
+        return bundles
+
+    def _remove_bundles(self, bundles):
+        """
+        remove the bundles that aren't in bundles, {lang: bundle filename}
+        """
+        if not os.path.exists(self.out_dir):
+            return
+        current = set(bundles.itervalues())
+        for name in os.listdir(self.out_dir):
+            if self.BUNDLE.match(name) and name not in current:
+                os.remove(os.path.join(self.out_dir, name))
+
+    def _write(self, path, data):
+        """
+        write data to path if it isn't already its content
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        write_if_changed(path, data)
+
+    def _merged(self, lang, filename, paths):
+        out = {}
+        for path in paths:
+            with open(os.path.join(path, lang, filename), 'r') as f:
+                out.update(json.loads(f.read()))
+        return out
+
+    def _write_namespace(self, lang, filename, paths):
+        out = self._merged(lang, filename, paths)
+        if self.usage:
+            out = self.usage.prune(re.sub('.json$', '', filename), out)
+        lang_path = os.path.join(self.out_dir, lang)
+        if not os.path.exists(lang_path):
+            os.makedirs(lang_path)
+
+        self._write(os.path.join(lang_path, filename),
+                    json.dumps(out, ensure_ascii=False, indent=2))
@@ -0,0 +1,162 @@
+import collections
+import hashlib
+import json
+import os
+import re
+
+# data-i18n="ns:key" or "[attr]ns:key;[html]ns:other" in html and js strings
+ATTRIBUTE = re.compile(r'''data-i18n\s*=\s*\\?["']([^"'\\]+)\\?["']''')
+# i18n.t('ns:key') or $.i18n.t("key", options)
+CALL = re.compile(r'''\.t\(\s*["']([^"']+)["']''')
+
+
+class LocaleUsage(object):
+    """
+    The translation keys referenced by the generated html and the javascript
+    of the app, core and plugins. Keys without a namespace are looked up in
+    the default and then the fallback namespace, like i18next does. A string
+    'ns:prefix' followed by + in javascript builds keys at runtime, so every
+    key of ns starting with prefix counts as used.
+    """
+
+    def __init__(self, namespaces, default_ns='index', fallback_ns='common'):
+        self.namespaces = set(namespaces)
+        self.default_ns = default_ns
+        self.fallback_ns = fallback_ns
+        self.used = set()
+        self.prefixes = set()
+        names = '|'.join(re.escape(ns) for ns in sorted(self.namespaces, key=len, reverse=True))
+        self._literal = re.compile(r'''["']((?:{0}):[\w.\-]+)["']'''.format(names))
+        self._prefix = re.compile(r'''["']((?:{0}):[\w.\-]*)["']\s*\+'''.format(names))
+
+    def scan(self, www_dir):
+        """
+        scan the html and javascript files of www_dir, plugins included,
+        leaving out the third party libraries in ext directories and the
+        locales
+        """
+        for root, dirs, files in os.walk(www_dir, followlinks=True):
+            dirs[:] = [d for d in dirs if d not in ('ext', 'locales') and not d.startswith('.')]
+            for f in files:
+                if f.endswith('.html') or f.endswith('.js'):
+                    with open(os.path.join(root, f), 'r') as fp:
+                        text = fp.read().decode('utf-8', 'replace')
+                    if f.endswith('.html'):
+                        self.scan_html(text)
+                    else:
+                        self.scan_js(text)
+        return self
+
+    def scan_html(self, text):
+        for value in ATTRIBUTE.findall(text):
+            for ref in value.split(';'):
+                self._add(re.sub(r'^\s*\[[^\]]*\]', '', ref).strip())
+
+    def scan_js(self, text):
+        self.scan_html(text)
+        for key in CALL.findall(text):
+            self._add(key)
+        for key in self._literal.findall(text):
+            self._add(key)
+        for prefix in self._prefix.findall(text):
+            ns, key = prefix.split(':', 1)
+            self.prefixes.add((ns, key))
+
+    def _add(self, ref):
+        if not ref or '{{' in ref or '<%' in ref:
+            # built when the page is rendered
+            return
+        if ':' in ref and ref.split(':', 1)[0] in self.namespaces:
+            self.used.add(tuple(ref.split(':', 1)))
+        else:
+            self.used.add((None, ref))
+
+    def is_used(self, ns, key):
+        """
+        is the key, nested keys joined by dots, of namespace ns referenced?
+        """
+        for candidate in self._candidates(key):
+            if (ns, candidate) in self.used:
+                return True
+            if ns in (self.default_ns, self.fallback_ns) and (None, candidate) in self.used:
+                return True
+        for prefix_ns, prefix in self.prefixes:
+            if prefix_ns == ns and key.startswith(prefix):
+                return True
+        return False
+
+    def _candidates(self, key):
+        # a.b.c is used if a.b.c, a.b or a is referenced
+        parts = key.split('.')
+        return ['.'.join(parts[:i]) for i in range(len(parts), 0, -1)]
+
+    def digest(self):
+        """
+        sha1 of the referenced keys, it changes when the keys do
+        """
+        return hashlib.sha1(json.dumps([
+            sorted(self.used), sorted(self.prefixes), self.default_ns, self.fallback_ns
+        ])).hexdigest()
+
+    def prune(self, ns, data):
+        """
+        copy of the translations data of namespace ns without the keys that
+        aren't referenced
+        """
+        return self._prune(ns, data, '')
+
+    def _prune(self, ns, data, path):
+        out = collections.OrderedDict()
+        for key, value in data.iteritems():
+            full = path + key
+            if self.is_used(ns, full):
+                out[key] = value
+            elif isinstance(value, dict):
+                value = self._prune(ns, value, full + '.')
+                if value:
+                    out[key] = value
+        return out
+
+    def report(self, locales):
+        """
+        the missing and unused keys of every language
+        locales --> {lang: {namespace: translations data}}
+        returns {lang: {"missing": [ns:key], "unused": [ns:key]}}
+        """
+        report = {}
+        for lang, namespaces in locales.iteritems():
+            keys = set()
+            for ns, data in namespaces.iteritems():
+                keys.update((ns, key) for key in _flatten(data))
+
+            unused = [(ns, key) for ns, key in keys if not self.is_used(ns, key)]
+            missing = []
+            for ns, key in self.used:
+                if ns is None:
+                    lookup = [(self.default_ns, key), (self.fallback_ns, key)]
+                else:
+                    lookup = [(ns, key)]
+                if not any(self._has(keys, n, k) for n, k in lookup):
+                    missing.append((ns or self.default_ns, key))
+            report[lang] = {
+                "missing": sorted('{0}:{1}'.format(ns, key) for ns, key in missing),
+                "unused": sorted('{0}:{1}'.format(ns, key) for ns, key in unused)
+            }
+        return report
+
+    def _has(self, keys, ns, key):
+        # a key referencing a nested object, e.g. for returnObjects
+        return (ns, key) in keys or any(n == ns and k.startswith(key + '.') for n, k in keys)
+
+
+def _flatten(data, path=''):
+    """
+    the keys of nested translations joined by dots
+    """
+    keys = []
+    for key, value in data.iteritems():
+        if isinstance(value, dict):
+            keys.extend(_flatten(value, path + key + '.'))
+        else:
+            keys.append(path + key)
+    return keys
@@ -0,0 +1,671 @@
+import collections
+import csv
+import datetime
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import subprocess
+import tempfile
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+# the patterns of the app requests counted by the stats tasks
+ANDROID_VERSIONS = ['2.3', '4.0', '4.1', '4.2', '4.3', '4.4', '5.0']
+EXPORT_FORMATS = ['geojson', 'kml', 'csv']
+
+PATTERNS = collections.OrderedDict(
+    [('android {0}'.format(v), 'splash.+Android {0}'.format(v)) for v in ANDROID_VERSIONS] +
+    [('export {0}'.format(f), 'records/dropbox/.+filter=format&frmt={0}'.format(f)) for f in EXPORT_FORMATS] +
+    [('uploaded records', 'POST.*?\/pcapi\/records\/dropbox\/.*?\/([^\.]+) HTTP')])
+
+# requests from edina are ignored
+EXCLUDE = ('129.215.169',)
+
+LOG_DIR = '/var/log/httpd/'
+LOG_NAME = re.compile(r'access_log\.(\d{4})-(\d{2})(?:-(\d{2}))?')
+LOG_DATE = re.compile(r'\[(\d{2})/(\w{3})/(\d{4}):')
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+
+def _line_date(line, logname=None):
+    """
+    the date of the request from the line timestamp, or from the log name if
+    the line has none
+    """
+    match = LOG_DATE.search(line)
+    if match and match.group(2) in MONTHS:
+        return datetime.date(int(match.group(3)), MONTHS[match.group(2)], int(match.group(1)))
+    if logname:
+        match = LOG_NAME.search(logname)
+        if match:
+            return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3) or 1))
+    return None
+
+
+class HyperLogLog(object):
+    """
+    Approximate count of distinct items in a fixed amount of memory, see
+    Flajolet et al. "HyperLogLog: the analysis of a near-optimal cardinality
+    estimation algorithm". Registers are kept in a dict while the dict is
+    smaller than the array of all of them, so small counts take little memory.
+    """
+
+    def __init__(self, error=0.01):
+        """
+        error - the relative standard error of the count, between 0.26 and
+                0.004, the memory used is about (1.04 / error)^2 bytes
+        """
+        self.p = max(4, min(16, int(math.ceil(math.log((1.04 / error) ** 2, 2)))))
+        self.m = 1 << self.p
+        self.registers = {}
+
+    def add(self, item):
+        x = int(hashlib.sha1(item).hexdigest()[:16], 16)
+        j = x >> (64 - self.p)
+        w = x & ((1 << (64 - self.p)) - 1)
+        rank = 64 - self.p - w.bit_length() + 1
+        self._set(j, rank)
+
+    def _set(self, j, rank):
+        registers = self.registers
+        current = registers[j] if isinstance(registers, bytearray) else registers.get(j, 0)
+        if rank > current:
+            registers[j] = rank
+            # a dict entry and its int key take about 100 bytes on python 2,
+            # the array 1 byte per register
+            if isinstance(registers, dict) and len(registers) > self.m / 128:
+                self.registers = bytearray(self.m)
+                for k, r in registers.iteritems():
+                    self.registers[k] = r
+
+    def update(self, other):
+        """
+        add the items counted by other, of the same error
+        """
+        items = other.registers.iteritems() if isinstance(other.registers, dict) else enumerate(other.registers)
+        for j, rank in items:
+            if rank:
+                self._set(j, rank)
+
+    def count(self):
+        m = float(self.m)
+        if isinstance(self.registers, dict):
+            ranks = self.registers.values()
+        else:
+            ranks = [r for r in self.registers if r]
+        zeros = self.m - len(ranks)
+        if self.m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+        estimate = alpha * m * m / (zeros + sum(2.0 ** -r for r in ranks))
+        if estimate <= 2.5 * m and zeros > 0:
+            # linear counting is more accurate for small counts
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def dumps(self):
+        registers = self.registers
+        if isinstance(registers, dict):
+            registers = bytearray(self.m)
+            for j, rank in self.registers.iteritems():
+                registers[j] = rank
+        return zlib.compress(str(registers))
+
+    def loads(self, data):
+        """
+        add the items counted by the dumps data of a HyperLogLog of the same
+        error
+        """
+        other = HyperLogLog.__new__(HyperLogLog)
+        other.registers = bytearray(zlib.decompress(data))
+        self.update(other)
+
+
+class Tally(object):
+    """
+    The requests of each client ip
+    """
+
+    def __init__(self):
+        self.ips = {}
+
+    def add(self, ip, count=1):
+        self.ips[ip] = self.ips.get(ip, 0) + count
+
+    def update(self, other):
+        for ip, count in other.ips.iteritems():
+            self.add(ip, count)
+
+    @property
+    def total(self):
+        return sum(self.ips.itervalues())
+
+    def unique(self):
+        return len(self.ips)
+
+
+class ApproximateTally(object):
+    """
+    The number of requests and an approximate count of the distinct client
+    ips, in at most (1.04 / error)^2 bytes whatever the number of ips
+    """
+
+    def __init__(self, error):
+        self.error = error
+        self.total = 0
+        self.ips = HyperLogLog(error)
+
+    def add(self, ip, count=1):
+        self.total += count
+        self.ips.add(ip)
+
+    def update(self, other):
+        self.total += other.total
+        self.ips.update(other.ips)
+
+    def unique(self):
+        return self.ips.count()
+
+
+class LogStats(object):
+    """
+    Counts of the access log requests matching a set of patterns, per pattern,
+    day, host and client ip. The logs are read once, whatever the number of
+    patterns: every line is matched against all of them, and the lines are
+    read as they come so only the counts are kept in memory.
+
+    With unique_error the ips aren't kept, the distinct ips are counted with
+    a HyperLogLog of that relative error instead, so the memory used depends
+    on the number of days and patterns only.
+    """
+
+    def __init__(self, patterns=PATTERNS, exclude=EXCLUDE, unique_error=None):
+        """
+        patterns - {name: regular expression} of the requests to count
+        exclude - prefixes of the ips to ignore
+        unique_error - relative error of the approximate unique ips counts,
+                       None to count them exactly
+        """
+        self.patterns = collections.OrderedDict(patterns)
+        self.exclude = tuple(exclude)
+        self.unique_error = unique_error
+        self._regexes = [(name, re.compile(p)) for name, p in self.patterns.iteritems()]
+        self.counts = dict((name, {}) for name in self.patterns)
+
+    def empty(self):
+        """
+        LogStats of the same patterns without counts
+        """
+        return LogStats(self.patterns, self.exclude, self.unique_error)
+
+    def tally(self):
+        """
+        new tally of the requests of a day
+        """
+        if self.unique_error:
+            return ApproximateTally(self.unique_error)
+        return Tally()
+
+    def pattern(self):
+        """
+        a single regular expression matching the lines of all the patterns,
+        for filtering the logs before counting them
+        """
+        return '|'.join('(?:{0})'.format(p) for p in self.patterns.itervalues())
+
+    def add(self, line, logname=None, host=None):
+        """
+        count a log line
+        logname - name of the log file, for dating lines without a timestamp
+        host - the server of the log
+        """
+        ip = line.split(' ', 1)[0].strip()
+        if len(ip) == 0 or ip.startswith(self.exclude):
+            return
+        day = None
+        for name, regex in self._regexes:
+            if regex.search(line):
+                if day is None:
+                    day = _line_date(line, logname)
+                    if day is None:
+                        return
+                days = self.counts[name]
+                if (day, host) not in days:
+                    days[day, host] = self.tally()
+                days[day, host].add(ip)
+
+    def add_lines(self, lines):
+        """
+        count the (logname, line) of lines
+        """
+        for logname, line in lines:
+            self.add(line, logname)
+        return self
+
+    def update(self, other, host=None):
+        """
+        add the counts of other, a LogStats of the same patterns
+        host - the server of the counts of other, if it isn't set in them
+        """
+        for name, days in other.counts.iteritems():
+            mine = self.counts[name]
+            for (day, h), tally in days.iteritems():
+                key = (day, h or host)
+                if key not in mine:
+                    mine[key] = self.tally()
+                mine[key].update(tally)
+        return self
+
+    def digest(self):
+        """
+        sha1 of the patterns, exclusions and unique error, counts made with
+        different ones can't be reused
+        """
+        return hashlib.sha1(json.dumps([self.patterns.items(), self.exclude, self.unique_error])).hexdigest()
+
+    def months(self, name, year):
+        """
+        the tally of the requests of pattern name in every month of year,
+        {month: tally}
+        """
+        months = collections.OrderedDict((i, self.tally()) for i in range(1, 13))
+        for (day, host), tally in self.counts[name].iteritems():
+            if day.year == int(year):
+                months[day.month].update(tally)
+        return months
+
+
+def parse_grep(lines):
+    """
+    the (logname, line) of the output lines of grep -H
+    """
+    for l in lines:
+        l = l.rstrip('\r\n')
+        if ':' not in l:
+            continue
+        logname, line = l.split(':', 1)
+        yield logname, line
+
+
+class LocalLogs(object):
+    """
+    Access logs in a local directory, e.g. copied from the servers or test
+    fixtures
+    """
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.host = log_dir
+
+    def list(self, year):
+        """
+        the (logname, size, mtime) of the access logs of year
+        """
+        prefix = 'access_log.{0}-'.format(year)
+        logs = []
+        for name in sorted(os.listdir(self.log_dir)):
+            if name.startswith(prefix):
+                path = os.path.join(self.log_dir, name)
+                st = os.stat(path)
+                logs.append((path, st.st_size, repr(st.st_mtime)))
+        return logs
+
+    def lines(self, lognames, pattern=None):
+        """
+        the (logname, line) of every line of the access logs lognames
+        pattern - only the lines matching this regular expression are needed
+        """
+        for path in lognames:
+            with open(path, 'r') as f:
+                for line in f:
+                    yield path, line.rstrip('\r\n')
+
+
+class StatsError(Exception):
+    pass
+
+
+def ssh_lines(host, cmd, connect_timeout=10):
+    """
+    run cmd on host with ssh and yield its output lines as they arrive.
+    Raises StatsError if ssh or the command fail, grep finding nothing isn't
+    a failure. The errors go to a temporary file, a pipe would block ssh once
+    full as it's only read when the output is done.
+    """
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(
+            ['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout={0}'.format(connect_timeout),
+             '-o', 'ServerAliveInterval=15', host, cmd],
+            stdout=subprocess.PIPE, stderr=errors)
+        for line in iter(process.stdout.readline, ''):
+            yield line
+        if process.wait() > 1:
+            errors.seek(0)
+            raise StatsError('{0} failed on {1}: {2}'.format(
+                cmd.split(' ')[0], host, errors.read().strip()))
+
+
+class RemoteLogs(object):
+    """
+    Access logs of a server, read with the commands run by run_command
+    """
+
+    def __init__(self, host, run_command=ssh_lines, log_dir=LOG_DIR):
+        """
+        host - the server
+        run_command - function(host, command) returning the output lines
+        log_dir - the directory of the logs in the server
+        """
+        self.host = host
+        self.run_command = run_command
+        self.log_dir = log_dir
+
+    def list(self, year):
+        """
+        the (logname, size, mtime) of the access logs of year
+        """
+        cmd = 'find {0} -name "access_log.{1}-*" -printf "%p %s %T@\\n"'.format(self.log_dir, year)
+        logs = []
+        for l in self.run_command(self.host, cmd):
+            parts = l.strip().split(' ')
+            if len(parts) == 3:
+                logs.append((parts[0], int(parts[1]), parts[2]))
+        return logs
+
+    def lines(self, lognames, pattern):
+        """
+        the (logname, line) of the lines of the access logs lognames matching
+        pattern, filtered in the server
+        """
+        if len(lognames) == 0:
+            return []
+        cmd = 'grep -HP "{0}" {1}'.format(pattern, ' '.join(lognames))
+        return parse_grep(self.run_command(self.host, cmd))
+
+
+class StatsIndex(object):
+    """
+    The counts of every access log already read, kept in a sqlite database
+    between runs. The logs are identified by host, name, size and
+    modification time, rotated logs don't change so they are only read once.
+    Approximate counts are stored as the total and the HyperLogLog of the ips
+    of each day.
+    """
+
+    SCHEMA = 2
+
+    def __init__(self, path):
+        d = os.path.dirname(path)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+        self.db = sqlite3.connect(path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA:
+            self.db.executescript("""
+                DROP TABLE IF EXISTS logs;
+                DROP TABLE IF EXISTS counts;
+                PRAGMA user_version = {0};
+            """.format(self.SCHEMA))
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS logs (
+                host TEXT, name TEXT, size INTEGER, mtime TEXT, digest TEXT,
+                PRIMARY KEY (host, name));
+            CREATE TABLE IF NOT EXISTS counts (
+                host TEXT, name TEXT, pattern TEXT, day TEXT, ip TEXT, count INTEGER, hll BLOB);
+            CREATE INDEX IF NOT EXISTS counts_log ON counts (host, name);
+        """)
+
+    def collect(self, source, year, stats):
+        """
+        add the counts of the access logs of year of source, a LocalLogs or
+        RemoteLogs, to stats. Only the logs that are new or changed since the
+        last run are read. Returns the number of logs read.
+        """
+        known = self.known(source.host, stats)
+        return self.apply(source.host, year, stats, *fetch(source, year, stats, known))
+
+    def known(self, host, stats):
+        """
+        {logname: (size, mtime)} of the logs of host already counted with
+        the patterns of stats
+        """
+        digest = stats.digest()
+        return dict(((name, (size, mtime)) for name, size, mtime in self.db.execute(
+            'SELECT name, size, mtime FROM logs WHERE host = ? AND digest = ?', (host, digest))))
+
+    def apply(self, host, year, stats, listed, counts):
+        """
+        store the counts read by fetch and add the counts of all the listed
+        logs to stats, returns the number of logs read
+        """
+        digest = stats.digest()
+        prefix = 'access_log.{0}-'.format(year)
+        names = set(name for name, size, mtime in listed)
+        for (name,) in self.db.execute('SELECT name FROM logs WHERE host = ?', (host,)).fetchall():
+            if os.path.basename(name).startswith(prefix) and (name not in names or name in counts):
+                self._delete(host, name)
+        for name, size, mtime in listed:
+            if name in counts:
+                self._store(host, name, size, mtime, digest, counts[name])
+        self.db.commit()
+
+        for name, size, mtime in listed:
+            self._load(host, name, stats)
+        return len(counts)
+
+    def cached(self, host, year, stats):
+        """
+        add the counts of the logs of year of host counted by previous runs,
+        when the host can't be reached
+        """
+        prefix = 'access_log.{0}-'.format(year)
+        for name in self.known(host, stats):
+            if os.path.basename(name).startswith(prefix):
+                self._load(host, name, stats)
+
+    def _delete(self, host, name):
+        self.db.execute('DELETE FROM logs WHERE host = ? AND name = ?', (host, name))
+        self.db.execute('DELETE FROM counts WHERE host = ? AND name = ?', (host, name))
+
+    def _store(self, host, name, size, mtime, digest, stats):
+        self.db.execute('INSERT INTO logs VALUES (?, ?, ?, ?, ?)', (host, name, size, mtime, digest))
+        if stats is None:
+            return
+        rows = []
+        for pattern, days in stats.counts.iteritems():
+            for (day, h), tally in days.iteritems():
+                if isinstance(tally, ApproximateTally):
+                    rows.append((host, name, pattern, day.isoformat(), None, tally.total,
+                                 sqlite3.Binary(tally.ips.dumps())))
+                else:
+                    for ip, count in tally.ips.iteritems():
+                        rows.append((host, name, pattern, day.isoformat(), ip, count, None))
+        self.db.executemany('INSERT INTO counts VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _load(self, host, name, stats):
+        for pattern, day, ip, count, hll in self.db.execute(
+                'SELECT pattern, day, ip, count, hll FROM counts WHERE host = ? AND name = ?', (host, name)):
+            if pattern not in stats.counts:
+                continue
+            key = (datetime.datetime.strptime(day, '%Y-%m-%d').date(), host)
+            days = stats.counts[pattern]
+            if key not in days:
+                days[key] = stats.tally()
+            if hll is None:
+                days[key].add(ip, count)
+            else:
+                days[key].total += count
+                days[key].ips.loads(str(hll))
+
+    def close(self):
+        self.db.close()
+
+
+def fetch(source, year, stats, known):
+    """
+    list the logs of year of source and count the logs that aren't in known,
+    {logname: (size, mtime)}. Doesn't use the index so it can run in another
+    thread. Returns (listed logs, {logname: LogStats})
+    """
+    listed = source.list(year)
+    changed = [name for name, size, mtime in listed if known.get(name) != (size, mtime)]
+    counts = dict((name, stats.empty()) for name in changed)
+    if changed:
+        for logname, line in source.lines(changed, stats.pattern()):
+            if logname in counts:
+                counts[logname].add(line, logname)
+    return listed, counts
+
+
+def collect(index, sources, year, stats, workers=4, timeout=600):
+    """
+    add the counts of the logs of year of all the sources to stats, fetching
+    up to workers sources at a time. The counts of every source are stored
+    as soon as it is done. A source that fails or isn't done after timeout
+    seconds is reported and the counts of its logs from previous runs are
+    used instead.
+    returns {host: number of logs read, or the error}
+    """
+    known = dict((source.host, index.known(source.host, stats)) for source in sources)
+    pool = ThreadPool(max(1, min(workers, len(sources))))
+    pending = [(source, pool.apply_async(fetch, (source, year, stats, known[source.host])))
+               for source in sources]
+    deadline = time.time() + timeout
+    results = {}
+    try:
+        while pending:
+            for source, result in list(pending):
+                if not result.ready():
+                    continue
+                pending.remove((source, result))
+                try:
+                    listed, counts = result.get()
+                except Exception, e:
+                    results[source.host] = e
+                    index.cached(source.host, year, stats)
+                else:
+                    results[source.host] = index.apply(source.host, year, stats, listed, counts)
+            if pending:
+                if time.time() > deadline:
+                    for source, result in pending:
+                        results[source.host] = StatsError('timed out after {0}s'.format(timeout))
+                        index.cached(source.host, year, stats)
+                    break
+                pending[0][1].wait(0.1)
+    finally:
+        pool.terminate()
+    return results
+
+
+# the columns a report can be grouped by, version and format only include
+# the android and export patterns
+GROUPS = ['year', 'month', 'week', 'day', 'host', 'pattern', 'version', 'format']
+KINDS = {'version': 'android', 'format': 'export'}
+
+
+def _group_key(group, day, host, pattern):
+    if group == 'year':
+        return str(day.year)
+    if group == 'month':
+        return day.strftime('%Y-%m')
+    if group == 'week':
+        year, week, weekday = day.isocalendar()
+        return '{0}-W{1:02d}'.format(year, week)
+    if group == 'day':
+        return day.isoformat()
+    if group == 'host':
+        return host
+    if group == 'pattern':
+        return pattern
+    return pattern.split(' ', 1)[1]
+
+
+class Report(object):
+    """
+    The requests counted between the dates start and end, both included,
+    grouped by the columns group_by, see GROUPS. The counts are added to the
+    groups one LogStats at a time, e.g. a year at a time, so only the tallies
+    of the groups are kept, not those of every day.
+    """
+
+    def __init__(self, stats, start, end, group_by=('month',), patterns=None):
+        """
+        stats - LogStats of the patterns counted, its counts aren't added
+        patterns - names of the patterns included, all by default
+        raises ValueError for unknown group_by columns or pattern names
+        """
+        for group in group_by:
+            if group not in GROUPS:
+                raise ValueError('Unknown stats group {0}, use some of {1}'.format(group, ', '.join(GROUPS)))
+        for name in patterns or []:
+            if name not in stats.patterns:
+                raise ValueError('Unknown stats pattern {0}, use some of {1}'.format(
+                    name, ', '.join(stats.patterns)))
+        names = patterns or stats.patterns.keys()
+        for kind in [KINDS[g] for g in group_by if g in KINDS]:
+            names = [n for n in names if n.split(' ', 1)[0] == kind]
+
+        self.start = start
+        self.end = end
+        self.group_by = list(group_by)
+        self.names = names
+        self.groups = {}
+        self._stats = stats.empty()
+
+    def add(self, stats):
+        """
+        add the counts of stats, a LogStats of the same patterns
+        """
+        for name in self.names:
+            for (day, host), tally in stats.counts[name].iteritems():
+                if self.start <= day <= self.end:
+                    key = tuple(_group_key(g, day, host, name) for g in self.group_by)
+                    if key not in self.groups:
+                        self.groups[key] = self._stats.tally()
+                    self.groups[key].update(tally)
+        return self
+
+    def rows(self):
+        """
+        the rows as OrderedDicts of the group_by columns and the unique ips
+        and total requests, sorted by the group_by columns
+        """
+        rows = []
+        for key in sorted(self.groups.iterkeys()):
+            row = collections.OrderedDict(zip(self.group_by, key))
+            row['unique'] = self.groups[key].unique()
+            row['total'] = self.groups[key].total
+            rows.append(row)
+        return rows
+
+
+def report(stats, start, end, group_by=('month',), patterns=None):
+    """
+    the rows of the Report of the counts of stats, see Report
+    """
+    return Report(stats, start, end, group_by, patterns).add(stats).rows()
+
+
+def write_csv(rows, f):
+    """
+    write the report rows to the file f as csv
+    """
+    if len(rows) == 0:
+        return
+    writer = csv.writer(f)
+    writer.writerow(rows[0].keys())
+    for row in rows:
+        writer.writerow(row.values())
+
+
+def write_json(rows, f):
+    """
+    write the report rows to the file f as a json list
+    """
+    json.dump(rows, f, indent=2)
+    f.write('\n')
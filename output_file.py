@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_if_changed(path, data):
+    '''
+    atomically replace the content of path with data, a byte string, unless
+    it already is its content. The data is written to a temporary file in the
+    same directory and renamed over path so a partially written file never
+    exists and the modification time of unchanged files is kept.
+    returns True if path was written
+    '''
+    if os.path.isfile(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+
+    d = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=d, prefix='.{0}.'.format(os.path.basename(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode & 0777
+        else:
+            mode = 0666 & ~_umask()
+        os.chmod(tmp, mode)
+        if os.name == 'nt' and os.path.exists(path):
+            # rename doesn't replace files on windows
+            os.remove(path)
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
@@ -7,39 +7,63 @@ define(function(require) {
     var catalogText = require('text!../locales/catalog.json');
     var catalog = JSON.parse(catalogText);
 
-    i18next
-        .use(i18nextXHRbackend)
-        .init({
-            debug: false,
-            lng: 'en',
-            preload: catalog.languages,
-            lngs: catalog.languages,
-            fallbackLng: 'en',
-            ns: catalog.namespaces,
-            defaultNS: 'index',
-            fallbackNS: 'common',
-            backend: {
-                loadPath: 'locales/{{lng}}/{{ns}}.json'
-            }
-        }, function(err, t) {
-            var userLng = localStorage.getItem('user-language');
-
-            i18nextJquery.init(i18next, $, {
-                tName: 't',
-                i18nName: 'i18n',
-                handleName: 'localize',
-                selectorAttr: 'data-i18n',
-                targetAttr: 'data-i18n-target',
-                optionsAttr: 'data-i18n-options',
-                useOptionsAttr: false,
-                parseDefaultValueFromContent: true
-            });
+    var options = {
+        debug: false,
+        lng: 'en',
+        preload: catalog.languages,
+        lngs: catalog.languages,
+        fallbackLng: 'en',
+        ns: catalog.namespaces,
+        defaultNS: 'index',
+        fallbackNS: 'common'
+    };
 
-            $(document).on('pagecreate', function(event, ui) {
-                $(event.target).localize();
-            });
+    var init = function() {
+        i18next.init(options, initialised);
+    };
+
+    var initialised = function(err, t) {
+        var userLng = localStorage.getItem('user-language');
+
+        i18nextJquery.init(i18next, $, {
+            tName: 't',
+            i18nName: 'i18n',
+            handleName: 'localize',
+            selectorAttr: 'data-i18n',
+            targetAttr: 'data-i18n-target',
+            optionsAttr: 'data-i18n-options',
+            useOptionsAttr: false,
+            parseDefaultValueFromContent: true
+        });
 
-            i18next.changeLanguage(userLng);
-            $(document).localize();
+        $(document).on('pagecreate', function(event, ui) {
+            $(event.target).localize();
+        });
+
+        i18next.changeLanguage(userLng);
+        $(document).localize();
+    };
+
+    if (catalog.bundles) {
+        // one file with all the namespaces of each language
+        var languages = Object.keys(catalog.bundles);
+        var files = languages.map(function(lng) {
+            return 'text!../locales/' + catalog.bundles[lng];
+        });
+        require(files, function() {
+            var bundles = arguments;
+            options.resources = {};
+            languages.forEach(function(lng, i) {
+                options.resources[lng] = JSON.parse(bundles[i]);
+            });
+            init();
         });
+    }
+    else {
+        i18next.use(i18nextXHRbackend);
+        options.backend = {
+            loadPath: 'locales/{{lng}}/{{ns}}.json'
+        };
+        init();
+    }
 });
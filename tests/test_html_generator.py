@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_generator import HtmlGenerator
+
+
+class HtmlGeneratorTest(unittest.TestCase):
+    """
+    Generate the pages of core and project templates created in a temporary
+    directory
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.root, 'src')
+        self.proj_home = os.path.join(self.root, 'project')
+        self.core = os.path.join(self.src_dir, 'templates')
+        self.project = os.path.join(self.proj_home, 'src', 'templates')
+        os.makedirs(os.path.join(self.root, 'plugins'))
+        os.makedirs(self.project)
+
+        self._write(os.path.join(self.src_dir, 'www', 'theme', 'project.json'),
+                    {"plugins": {"fieldtrip": {}}})
+        self._write(os.path.join(self.core, 'header.json'), {"title": "Fieldtrip"})
+        self._write(os.path.join(self.core, 'footer.json'), {})
+        self._write(os.path.join(self.core, 'header.html'), '<h1>{{ data.title }}</h1>')
+        self._write(os.path.join(self.core, 'footer.html'), '<p>footer</p>')
+        self._write(os.path.join(self.core, 'settings.html'),
+                    '<div>{{ header }}{{ settings }}{{ footer }}</div>')
+        self._write(os.path.join(self.core, 'map.json'), {"body": {"a": "map"}})
+        self._write(os.path.join(self.core, 'map.html'),
+                    '<div>{{ header }}{{ body.a }}{{ footer }}</div>')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, data):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data if isinstance(data, basestring) else json.dumps(data))
+
+    def _read(self, name):
+        with open(os.path.join(self.src_dir, 'www', name), 'r') as f:
+            return f.read()
+
+    def _generator(self):
+        return HtmlGenerator('android', False, self.root, self.proj_home, self.src_dir,
+                             {}, None, formatter='none')
+
+    def test_rebuild_after_failure(self):
+        generator = self._generator()
+        generator.generate()
+        self.assertIn('<h1>Fieldtrip</h1>', self._read('map.html'))
+
+        # saved half way through an edit
+        self._write(os.path.join(self.core, 'map.json'), '{"body": ')
+        self.assertRaises(SystemExit, generator.generate)
+
+        self._write(os.path.join(self.core, 'map.json'), {"body": {"a": "edited"}})
+        generator.generate()
+        self.assertIn('edited', self._read('map.html'))
+
+        self._write(os.path.join(self.core, 'header.json'), {"title": "Renamed"})
+        generator.generate()
+        self.assertIn('<h1>Renamed</h1>', self._read('map.html'))
+
+    def test_referenced_templates(self):
+        self._write(os.path.join(self.core, 'base.html'), '<div>{% block body %}{% endblock %}</div>')
+        self._write(os.path.join(self.core, 'snippet.html'), '<p>ONE</p>')
+        self._write(os.path.join(self.project, 'proj.json'), {})
+        self._write(os.path.join(self.project, 'proj.html'),
+                    '{% extends "base.html" %}{% block body %}{% include "snippet.html" %}{% endblock %}')
+        self._generator().generate()
+        self.assertIn('<p>ONE</p>', self._read('proj.html'))
+
+        self._write(os.path.join(self.core, 'snippet.html'), '<p>TWO</p>')
+        self._generator().generate()
+        self.assertIn('<p>TWO</p>', self._read('proj.html'))
+
+        self._write(os.path.join(self.core, 'base.html'), '<span>{% block body %}{% endblock %}</span>')
+        self._generator().generate()
+        self.assertIn('<span><p>TWO</p></span>', self._read('proj.html'))
+
+    def test_render_writes_nothing(self):
+        self._write(os.path.join(self.core, 'map.json'),
+                    {"body": {"a": "map"}, "templates": {"list": "list-template.html"}})
+        self._write(os.path.join(self.core, 'list-template.html'), '<li>item</li>')
+        pages, templates = self._generator().render()
+        self.assertEqual(sorted(pages), ['map.html', 'settings.html'])
+        self.assertIn('<h1>Fieldtrip</h1>', pages['map.html'])
+        self.assertEqual(templates, {'list-template.html': '<li>item</li>'})
+        self.assertEqual(os.listdir(os.path.join(self.src_dir, 'www')), ['theme'])
+
+
+if __name__ == '__main__':
+    unittest.main()
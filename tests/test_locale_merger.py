@@ -0,0 +1,109 @@
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from locale_merger import LocaleMerger, _find_translations
+
+PLUGINS = 120
+
+
+class LocaleMergerTest(unittest.TestCase):
+    """
+    Merge the translations of a core, 120 plugins and a project created in a
+    temporary directory
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.root, 'src')
+        self.proj_home = os.path.join(self.root, 'project')
+        self.plugins = ['plugin-{0:03d}'.format(i) for i in range(PLUGINS)]
+
+        self._translation(os.path.join(self.src_dir, 'locales'), 'en', 'index.json',
+                          {'owner': 'core', 'core': 'core'})
+        # create the plugins out of order, the merge order mustn't depend on it
+        for plugin in random.Random(0).sample(self.plugins, PLUGINS):
+            self._translation(self._plugin_dir(plugin), 'en', 'index.json',
+                              {'owner': plugin, 'plugin': plugin})
+        self._translation(self._plugin_dir('plugin-057'), 'cy', 'map.json',
+                          {'owner': 'plugin-057'})
+        self._translation(os.path.join(self.proj_home, 'src', 'locales'), 'en', 'index.json',
+                          {'owner': 'project'})
+        # not translations
+        os.makedirs(os.path.join(self.root, 'plugins', 'no-locales', 'src'))
+        with open(os.path.join(self._plugin_dir('plugin-001'), 'README'), 'w') as f:
+            f.write('readme')
+        with open(os.path.join(self._plugin_dir('plugin-001'), 'en', 'notes.txt'), 'w') as f:
+            f.write('notes')
+
+        self.merger = LocaleMerger(self.root, self.proj_home, self.src_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _plugin_dir(self, plugin):
+        return os.path.join(self.root, 'plugins', plugin, 'src', 'locales')
+
+    def _translation(self, locales_dir, lang, filename, translations):
+        lang_dir = os.path.join(locales_dir, lang)
+        if not os.path.exists(lang_dir):
+            os.makedirs(lang_dir)
+        with open(os.path.join(lang_dir, filename), 'w') as f:
+            json.dump(translations, f)
+
+    def _output(self, lang, filename):
+        with open(os.path.join(self.src_dir, 'www', 'locales', lang, filename), 'r') as f:
+            return json.load(f)
+
+    def test_precedence(self):
+        expected = ([os.path.join(self.src_dir, 'locales')] +
+                    [self._plugin_dir(p) for p in self.plugins] +
+                    [os.path.join(self.proj_home, 'src', 'locales')])
+        self.assertEqual(_find_translations(self.merger.source_dirs())['en']['index.json'],
+                         expected)
+
+        self.merger.merge()
+        self.assertEqual(self._output('en', 'index.json'), {
+            'owner': 'project',
+            'core': 'core',
+            'plugin': self.plugins[-1]
+        })
+
+    def test_language_of_one_plugin(self):
+        locales = _find_translations(self.merger.source_dirs())
+        self.assertEqual(locales['cy'], {'map.json': [self._plugin_dir('plugin-057')]})
+        self.assertEqual(sorted(locales['en']), ['index.json'])
+
+        self.merger.merge()
+        self.assertEqual(self._output('cy', 'map.json'), {'owner': 'plugin-057'})
+        self.assertFalse(os.path.exists(
+            os.path.join(self.src_dir, 'www', 'locales', 'cy', 'index.json')))
+        with open(os.path.join(self.src_dir, 'www', 'locales', 'catalog.json'), 'r') as f:
+            catalog = json.load(f)
+        self.assertEqual(sorted(catalog['languages']), ['cy', 'en'])
+        self.assertEqual(sorted(catalog['namespaces']), ['index', 'map'])
+
+    def test_no_shared_state(self):
+        dirs = self.merger.source_dirs()
+        first = _find_translations(dirs)
+        first['en']['index.json'].append('/elsewhere')
+        first['fr'] = {'index.json': ['/elsewhere']}
+
+        self.assertEqual(_find_translations([self._plugin_dir('plugin-057')]), {
+            'en': {'index.json': [self._plugin_dir('plugin-057')]},
+            'cy': {'map.json': [self._plugin_dir('plugin-057')]}
+        })
+        second = _find_translations(dirs)
+        self.assertNotIn('fr', second)
+        self.assertEqual(len(second['en']['index.json']), PLUGINS + 2)
+        self.assertNotIn('/elsewhere', second['en']['index.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
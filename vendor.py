@@ -0,0 +1,167 @@
+import collections
+import hashlib
+import json
+import os
+import re
+
+from output_file import write_if_changed
+
+VERSION = 1
+
+
+class VendorError(Exception):
+    pass
+
+
+class Vendor(object):
+    '''
+    Copy the files of the bower dependencies listed in the
+    dependency_locations of bower.json into www/js/ext and www/css/ext. A
+    dependency in dependency_conditions is only vendored if every setting
+    it names has the given value, e.g. {"leaflet": {"maplib": "leaflet"}}.
+    What was vendored is written to a manifest so an install with the same
+    bower.json, settings and vendored files can skip bower and the copying.
+    The files built by the install, e.g. openlayers.js, are recorded in the
+    manifest too so they are removed once they aren't built any more.
+    '''
+
+    def __init__(self, bower_file, bower_home, www_dir, settings, manifest):
+        '''
+        bower_file --> path of bower.json
+        bower_home --> the bower_components directory
+        www_dir --> the www directory the files are vendored into
+        settings --> {name: value} the conditions are checked against
+        manifest --> path of the manifest
+        '''
+        self.bower_file = bower_file
+        self.bower_home = bower_home
+        self.www_dir = www_dir
+        self.settings = settings or {}
+        self.manifest = manifest
+        with open(bower_file, 'r') as f:
+            self.bower = json.load(f, object_pairs_hook=collections.OrderedDict)
+
+    def files(self):
+        '''
+        the files to vendor
+        returns [(source path, destination relative to www_dir)]
+        '''
+        conditions = self.bower.get('dependency_conditions', {})
+        files = []
+        for dep, locations in self.bower['dependency_locations'].iteritems():
+            if not all(self.settings.get(k) == v for k, v in conditions.get(dep, {}).iteritems()):
+                continue
+
+            version = self.bower['dependencies'][dep]
+            if version[:4] == 'http':
+                # if a url has been given get the version from it
+                version = re.search(r'((\d\.){2}\d)', version).group(0)
+            name = dep.replace('-bower', '')
+            for f in locations:
+                f = f.replace('x.x', version)
+                if f.endswith('.js'):
+                    dest = 'js/ext/{0}.js'.format(name)
+                elif f.endswith('.map'):
+                    # keep the name the minified js points to
+                    dest = 'js/ext/{0}'.format(os.path.basename(f))
+                else:
+                    dest = 'css/ext/{0}.css'.format(name)
+                files.append((os.path.join(self.bower_home, dep, *f.split('/')), dest))
+        return files
+
+    def _key(self, files):
+        with open(self.bower_file, 'rb') as f:
+            h = hashlib.sha1(f.read())
+        h.update(json.dumps([VERSION, files]))
+        return h.hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.manifest):
+            return {"key": None, "files": {}, "built": []}
+        with open(self.manifest, 'r') as f:
+            return json.load(f)
+
+    def _save(self, key, files, built):
+        d = os.path.dirname(self.manifest)
+        if not os.path.exists(d):
+            os.makedirs(d)
+        write_if_changed(self.manifest, json.dumps({
+            "version": VERSION,
+            "key": key,
+            "files": files,
+            "built": built
+        }, indent=2))
+
+    def _dest(self, dest):
+        return os.path.join(self.www_dir, *dest.split('/'))
+
+    def is_current(self):
+        '''
+        are the vendored files those of the manifest and unchanged since?
+        '''
+        manifest = self._load()
+        if manifest["key"] != self._key(self.files()):
+            return False
+        for dest, sha1 in manifest["files"].iteritems():
+            path = self._dest(dest)
+            if not os.path.isfile(path):
+                return False
+            with open(path, 'rb') as f:
+                if hashlib.sha1(f.read()).hexdigest() != sha1:
+                    return False
+        return True
+
+    def vendor(self):
+        '''
+        copy the files that changed, remove the files vendored by the last
+        install that aren't any more and write the manifest
+        returns (copied, unchanged, removed)
+        '''
+        files = self.files()
+        missing = [src for src, dest in files if not os.path.isfile(src)]
+        if missing:
+            raise VendorError('Missing bower files, run bower install:\n{0}'.format(
+                '\n'.join(missing)))
+
+        vendored = collections.OrderedDict()
+        copied = unchanged = 0
+        for src, dest in files:
+            path = self._dest(dest)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(src, 'rb') as f:
+                data = f.read()
+            if write_if_changed(path, data):
+                copied += 1
+            else:
+                unchanged += 1
+            vendored[dest] = hashlib.sha1(data).hexdigest()
+
+        manifest = self._load()
+        removed = self._remove(manifest["files"], vendored)
+        self._save(self._key(files), vendored, manifest.get("built", []))
+        return copied, unchanged, removed
+
+    def built(self, built):
+        '''
+        record the files built into www_dir by the install and remove the
+        files built by the last install that aren't any more
+        built --> [destination relative to www_dir]
+        returns the number of files removed
+        '''
+        manifest = self._load()
+        removed = self._remove(manifest.get("built", []), built)
+        self._save(manifest["key"], manifest["files"], sorted(built))
+        return removed
+
+    def _remove(self, previous, current):
+        '''
+        remove the files of previous that aren't in current
+        returns the number of files removed
+        '''
+        removed = 0
+        for dest in previous:
+            if dest not in current and os.path.exists(self._dest(dest)):
+                os.remove(self._dest(dest))
+                removed += 1
+        return removed